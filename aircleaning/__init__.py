@@ -1 +1 @@
-__all__ = ('analyse', 'load', 'produce')
\ No newline at end of file
+__all__ = ('analyse', 'load', 'produce', 'recommend')
\ No newline at end of file
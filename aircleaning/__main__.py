@@ -7,60 +7,147 @@
 #     raise RuntimeError("This script expects to be executed.")
 # raise Exception
 
-print("Running application code...")
-
 
 import os
-import hashlib
 import sys
 import argparse
 
 from . import load, analyse, produce
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-f", '--force', help="Force execution", action='store_true')
-args = parser.parse_args()
-
-
 repodir = os.path.dirname(__file__)
 productsdir = os.path.join(repodir, 'products')
 
 
+tokenpath = 'token.json'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", '--force', help="Force execution", action='store_true')
+    parser.add_argument(
+        "-o", '--offline', help="Use local sheet snapshots only", action='store_true'
+        )
+    parser.add_argument(
+        "-j", '--jobs', help="Worker processes for rendering room scenes",
+        type=int, default=1,
+        )
+    parser.add_argument(
+        "-r", '--maxrank',
+        help="Only chart products within this many fronts of the skyline (0: skyline only)",
+        type=int, default=None,
+        )
+    return parser
+
+
 def get_token():
-    m = hashlib.sha256()
-    for dsetname in ('main', 'volume', 'quality', 'parameters'):
-        data = getattr(load, f'pull_{dsetname}_data')()
-        strn = data.to_string()
-        m.update(strn.encode())
-    return m.digest()
+    return load.make_token(load.fingerprints())
+
+
+def get_update(changes, loadtoken, /):
+    # When only the main sheet changed and the previous run's results and
+    # catalogue are still on hand, work out which products need redoing.
+    if set(changes) != {'main'}:
+        return None
+    digest = loadtoken['datasets']['main']['digest']
+    try:
+        previous = analyse.read_results(digest)
+        old = load.load_version('main', -2)
+    except (KeyError, OSError):
+        return None
+    if load.fingerprint(old).digest != digest:
+        return None
+    results, grid = previous['results'], previous['grid']
+    vols, quals = load.get_volume_data(), load.get_quality_data()
+    if not (
+            list(results.index.unique('cadr')) == produce.cost_targets()
+            and list(grid.index.unique('volume')) == list(vols['levels'])
+            and list(grid.index.unique('quality')) == list(quals['levels'])
+            ):
+        return None
+    return analyse.update_cost_analysis_by_cadrs(
+        results, old, load.get_main_data(), delta=changes['main'], grid=grid,
+        )
+
+
+def execute(update=None, /, jobs=1, maxrank=None):
+    if update is None:
+        produce.multi_cost_analysis(maxrank=maxrank)
+        produce.synoptic(maxrank=maxrank)
+        produce.decision_tool(jobs=jobs, maxrank=maxrank)
+        produce.overview()
+    else:
+        produce.multi_cost_analysis(
+            grid=update.grid, charts=update.charts, maxrank=maxrank,
+            )
+        if update.synoptic:
+            produce.synoptic(maxrank=maxrank)
+        produce.decision_tool(
+            rooms=False, costs=update.buckets, results=update.results,
+            maxrank=maxrank,
+            )
+        if update.synoptic:
+            produce.overview()
+
+
+def save_results(token, update=None, /):
+    # Kept for the next run to update rather than recompute; both are
+    # memoised, so after a full run this costs nothing extra.
+    if update is None:
+        results = analyse.cost_analysis_by_cadrs(produce.cost_targets())
+        grid = produce.multi_cost_grid()
+    else:
+        results, grid = update.results, update.grid
+    analyse.write_results(
+        token['datasets']['main']['digest'], results=results, grid=grid,
+        )
+
 
+def main():
 
-token = get_token()
-with open('token.txt', mode='rb') as file:
-    loadtoken = file.read()
+    print("Running application code...")
 
+    args = get_parser().parse_args()
 
-def execute():
-    produce.multi_cost_analysis()
-    produce.synoptic()
-    produce.decision_tool()
-    produce.overview()
+    if args.offline:
+        load.OFFLINE = True
 
+    token = get_token()
+    loadtoken = load.read_token(tokenpath)
+    changes = load.compare_tokens(loadtoken, token)
 
-if token == loadtoken:
-    if args.force:
-        print("Forcing execution: running workflow...")
-        execute()
+    if not changes:
+        if args.force:
+            print("Forcing execution: running workflow...")
+            execute(jobs=args.jobs, maxrank=args.maxrank)
+            save_results(token)
+        else:
+            print("No changes detected: skipping workflow...")
     else:
-        print("No changes detected: skipping workflow...")
-else:
-    print("Changes detected: running workflow...")
-    execute()
-    with open('token.txt', mode='wb') as file:
-        file.write(token)
-
-print("Application code ran successfully.")
+        for dsetname, delta in changes.items():
+            print(
+                f"Changes detected in '{dsetname}': "
+                f"{len(delta.added)} added, {len(delta.removed)} removed, "
+                f"{len(delta.modified)} modified."
+                )
+        update = get_update(changes, loadtoken)
+        if update is None:
+            print("Running workflow...")
+        else:
+            print(
+                f"Running incremental workflow: {len(update.buckets)} cost charts, "
+                f"{len(update.charts)} volume/quality charts"
+                f"{', synoptic' if update.synoptic else ''} affected..."
+                )
+        execute(update, jobs=args.jobs, maxrank=args.maxrank)
+        save_results(token, update)
+        load.write_token(token, tokenpath)
+
+    print("Application code ran successfully.")
+
+
+if __name__ == '__main__':
+    main()
 
 
 ###############################################################################
@@ -3,86 +3,321 @@
 ###############################################################################
 
 
-import math
+import os
+import bisect
+import pickle
+import hashlib
+import inspect
+import functools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
 
 from . import load
+from .caching import LRUCache
 
 
-def cost_analysis(data=None, /, volume='medium', quality='good'):
+# Maximum number of analysis results held in memory.
+CACHESIZE = 256
+
+# Bump whenever an analysis changes what it computes, so that results
+# persisted by older code are recomputed rather than served.
+ANALYSIS_VERSION = 2
+
+# Directory to persist analysis results to; persistence is off when None.
+CACHEDIR = os.environ.get('AIRCLEANING_ANALYSIS_CACHE')
+
+_results = LRUCache(CACHESIZE)
+_defaultdigests = {}
+
+
+def _dataset_digest(name, /):
+    data = getattr(load, f'pull_{name}_data')()
+    try:
+        source, digest = _defaultdigests[name]
+    except KeyError:
+        pass
+    else:
+        if source is data:
+            return digest
+    digest = load.fingerprint(data).digest
+    _defaultdigests[name] = (data, digest)
+    return digest
+
+
+def _cache_key_part(val, /):
+    if val is None or isinstance(val, (str, bool, int, float, bytes)):
+        return val
+    if isinstance(val, pd.DataFrame):
+        return ('frame', load.fingerprint(val).digest)
+    if isinstance(val, (pd.Series, pd.Index)):
+        val = val.to_numpy()
+    if isinstance(val, np.ndarray):
+        return ('array', str(val.dtype), val.shape, val.tobytes())
+    if isinstance(val, np.generic):
+        return val.item()
+    if isinstance(val, (tuple, list)):
+        parts = tuple(map(_cache_key_part, val))
+        if type(val) in (tuple, list):
+            return parts
+        # Namedtuples like Uniform must not collide with plain tuples.
+        return (type(val).__qualname__, parts)
+    raise TypeError(f"Cannot memoise on argument of type {type(val)}.")
+
+
+def _cache_path(key, /):
+    digest = hashlib.sha256(repr(key).encode()).hexdigest()
+    return os.path.join(CACHEDIR, digest + '.pkl')
+
+
+def _cache_get(key, /):
+    try:
+        return _results.get(key)
+    except KeyError:
+        pass
+    if CACHEDIR is None:
+        raise KeyError(key)
+    try:
+        with open(_cache_path(key), mode='rb') as file:
+            result = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        raise KeyError(key)
+    _cache_put(key, result, persist=False)
+    return result
+
+
+def _cache_put(key, result, /, persist=True):
+    _results.put(key, result)
+    if persist and CACHEDIR is not None:
+        os.makedirs(CACHEDIR, exist_ok=True)
+        load.write_atomic(_cache_path(key), pickle.dumps(result))
+
+
+def clear_cache(persisted=False):
+    _results.clear()
+    _defaultdigests.clear()
+    if persisted and CACHEDIR is not None and os.path.isdir(CACHEDIR):
+        for name in os.listdir(CACHEDIR):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(CACHEDIR, name))
+
+
+def memoise(*datasets):
+    # Results are keyed by ANALYSIS_VERSION, the catalogue's fingerprint
+    # (the cached main sheet when 'data' is None), the other arguments, and
+    # the digests of those of the volume, quality and parameters sheets
+    # named in 'datasets', i.e. the ones the function may read.
+
+    def decorator(func, /):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            parts = []
+            for name, val in bound.arguments.items():
+                if name == 'data' and val is None:
+                    val = ('frame', _dataset_digest('main'))
+                parts.append((name, _cache_key_part(val)))
+            key = (
+                ANALYSIS_VERSION, func.__module__, func.__qualname__,
+                tuple(parts), tuple(zip(datasets, map(_dataset_digest, datasets))),
+                )
+            try:
+                result = _cache_get(key)
+            except KeyError:
+                result = func(*args, **kwargs)
+                _cache_put(key, result)
+            return load.view(result)
+
+        return wrapper
+
+    return decorator
+
 
+Catalogue = namedtuple(
+    'Catalogue',
+    ('index', 'cadr', 'cost', 'power', 'filterchanges', 'filtercost', 'noise'),
+    )
+
+COSTMETRICS = ('noise', 'upfront', 'running', 'power', 'filter', 'nunits')
+
+# Catalogue columns consumed by the cost model (besides 'noise', which is
+# replaced in place) and flag/text columns it discards.
+_CONSUMED = ('cadr', 'cost', 'power', 'filterchanges', 'filtercost')
+_DISCARDED = (
+    'ionising', 'uv', 'hepafilter', 'prefilter', 'charcoalfilter', 'name', 'notes',
+    )
+
+# Watts to kilowatt-hours per year.
+_KWH_PA = 24 * 365 / 1000
+
+
+# Manufacturers left off the decision tool's charts and recommendations.
+EXCLUDED_MANUFACTURERS = ('Dyson',)
+
+
+def drop_excluded(data, /):
+    return data.drop(
+        list(EXCLUDED_MANUFACTURERS), level='manufacturer', errors='ignore',
+        )
+
+
+def _eligible(data, /):
     if data is None:
         data = load.get_main_data()
+    return data.loc[~data['ionising'] & ~data['uv']]
+
+
+def _catalogue_arrays(data, /):
+    return Catalogue(data.index, *(
+        data[key].to_numpy(dtype=float) for key in Catalogue._fields[1:]
+        ))
+
+
+def catalogue(data=None, /):
+    return _catalogue_arrays(_eligible(data))
+
+
+def empty_cost_arrays(shape, /):
+    return {
+        key: np.empty(shape, dtype=(int if key == 'nunits' else float))
+        for key in COSTMETRICS
+        }
+
+
+def cost_kernel(cat, performance, nomcost, /, out=None):
+    # 'performance' broadcasts against the catalogue along its last axis.
+    inv = np.divide(1, performance)
+    if out is None:
+        out = empty_cost_arrays(np.broadcast_shapes(inv.shape, cat.cadr.shape))
+    noise, upfront, running, power, filtercost, nunits = \
+        (out[key] for key in COSTMETRICS)
+    np.multiply(inv, cat.filterchanges, out=filtercost)
+    np.multiply(filtercost, cat.filtercost, out=filtercost)
+    np.multiply(inv, cat.power, out=power)
+    np.multiply(power, _KWH_PA * nomcost, out=power)
+    np.add(filtercost, power, out=running)
+    np.multiply(inv, 10 ** (cat.noise / 10), out=noise)
+    np.log10(noise, out=noise)
+    np.multiply(noise, 10, out=noise)
+    np.ceil(inv, out=inv)
+    nunits[...] = inv
+    np.multiply(nunits, cat.cost, out=upfront)
+    return out
+
+
+def _cost_frame(data, metrics, /):
+    columns = {}
+    for col in data.columns:
+        if col == 'noise':
+            columns[col] = metrics['noise']
+        elif col not in _CONSUMED and col not in _DISCARDED:
+            columns[col] = data[col]
+    for key in COSTMETRICS[1:]:
+        columns[key] = metrics[key]
+    return pd.DataFrame(columns, index=data.index)
+
+
+@memoise('volume', 'quality', 'parameters')
+def cost_analysis(data=None, /, volume='medium', quality='good'):
 
     if isinstance(volume, str):
         volume = load.get_volume_data()['levels'].loc[volume]
     if isinstance(quality, str):
         quality = load.get_quality_data()['levels'].loc[quality]
 
-    data = data.loc[~data['ionising'] & ~data['uv']]
-    data = data.drop(
-        ['ionising', 'uv', 'hepafilter', 'prefilter', 'charcoalfilter', 'name', 'notes'],
-        axis=1,
+    data = _eligible(data)
+    cat = _catalogue_arrays(data)
+    metrics = cost_kernel(
+        cat, cat.cadr / volume / quality,
+        load.get_parameters().nominal_power_cost,
         )
 
-    ach = data['cadr'] / volume
-    data = data.drop('cadr', axis=1)
-    performance = ach / quality
-    nunits = (1 / performance).apply(math.ceil)
-    data['cost'] *= nunits
-    for col in ('power', 'filterchanges'):
-        data[col] = data[col] / performance
-    data['noise'] = 10 * np.log10(10 ** (data['noise'] / 10) / performance)
-    filtercost = data['filtercost'] * data['filterchanges']
-    data = data.drop(['filterchanges', 'filtercost'], axis=1)
-    nomcost = float(load.get_parameters_data().loc['nominal power cost', 'value'])
-    powercost = data['power'] / 1000 * 24 * 365 * nomcost
-    data = data.drop('power', axis=1)
-    data['upfront'] = data['cost']
-    data = data.drop('cost', axis=1)
-    data['running'] = filtercost + powercost
-    data['power'] = powercost
-    data['filter'] = filtercost
-    data['nunits'] = nunits
-
-    return data
+    return _cost_frame(data, metrics)
 
 
+@memoise('parameters')
 def cost_analysis_by_cadr(cadr, data=None, /):
 
-    if data is None:
-        data = load.get_main_data()
+    data = _eligible(data)
+    cat = _catalogue_arrays(data)
+    metrics = cost_kernel(
+        cat, cat.cadr / cadr,
+        load.get_parameters().nominal_power_cost,
+        )
 
-    data = data.loc[~data['ionising'] & ~data['uv']]
-    data = data.drop(
-        ['ionising', 'uv', 'hepafilter', 'prefilter', 'charcoalfilter', 'name', 'notes'],
-        axis=1,
+    return _cost_frame(data, metrics)
+
+
+def _levels(vals, getter, /):
+    if vals is None:
+        return getter()['levels'].to_numpy(dtype=float)
+    if isinstance(vals, str):
+        vals = (vals,)
+    levels = getter()['levels']
+    return np.array([
+        levels.loc[val] if isinstance(val, str) else val for val in vals
+        ], dtype=float)
+
+
+def _long_form(metrics, outer, index, /):
+    # Stacks metric arrays shaped (*outer lengths, len(index)) into a frame.
+    nrows = int(np.prod([len(vals) for _, vals in outer])) * len(index)
+    arrays, reps = [], 1
+    for _, vals in outer:
+        arrays.append(np.tile(
+            np.repeat(vals, nrows // (reps * len(vals))), reps
+            ))
+        reps *= len(vals)
+    # Taking positions keeps each level's dtype (e.g. categorical makers).
+    positions = np.tile(np.arange(len(index)), reps)
+    for level in range(index.nlevels):
+        arrays.append(index.get_level_values(level).take(positions))
+    return pd.DataFrame(
+        {key: metrics[key].reshape(-1) for key in COSTMETRICS},
+        index=pd.MultiIndex.from_arrays(
+            arrays, names=[name for name, _ in outer] + list(index.names),
+            ),
         )
 
-    performance = data['cadr'] / cadr
-    data = data.drop('cadr', axis=1)
-    nunits = (1 / performance).apply(math.ceil)
-    data['cost'] *= nunits
-    for col in ('power', 'filterchanges'):
-        data[col] = data[col] / performance
-    data['noise'] = 10 * np.log10(10 ** (data['noise'] / 10) / performance)
-    filtercost = data['filtercost'] * data['filterchanges']
-    data = data.drop(['filterchanges', 'filtercost'], axis=1)
-    nomcost = float(load.get_parameters_data().loc['nominal power cost', 'value'])
-    powercost = data['power'] / 1000 * 24 * 365 * nomcost
-    data = data.drop('power', axis=1)
-    data['upfront'] = data['cost']
-    data = data.drop('cost', axis=1)
-    data['running'] = filtercost + powercost
-    data['power'] = powercost
-    data['filter'] = filtercost
-    data['nunits'] = nunits
 
-    return data
+@memoise('volume', 'quality', 'parameters')
+def cost_grid(data=None, /, volumes=None, qualities=None):
 
+    volumes = _levels(volumes, load.get_volume_data)
+    qualities = _levels(qualities, load.get_quality_data)
 
+    cat = catalogue(data)
+    ach = cat.cadr / volumes[:, None, None]
+    metrics = cost_kernel(
+        cat, ach / qualities[None, :, None],
+        load.get_parameters().nominal_power_cost,
+        )
+
+    return _long_form(
+        metrics, (('volume', volumes), ('quality', qualities)), cat.index
+        )
+
+
+@memoise('parameters')
+def cost_analysis_by_cadrs(cadrs, data=None, /):
+
+    cadrs = np.array(cadrs, dtype=float).reshape(-1)
+
+    cat = catalogue(data)
+    metrics = cost_kernel(
+        cat, cat.cadr / cadrs[:, None],
+        load.get_parameters().nominal_power_cost,
+        )
+
+    return _long_form(metrics, (('cadr', cadrs),), cat.index)
+
+
+@memoise('volume', 'parameters')
 def synoptic_analysis(data=None, /, volume='medium'):
 
     if data is None:
@@ -93,7 +328,7 @@ def synoptic_analysis(data=None, /, volume='medium'):
         volume = load.get_volume_data()['levels'].loc[volume]
 
     ach = data['cadr'] / volume
-    nomperiod = float(load.get_parameters_data().loc['nominal period', 'value'])
+    nomperiod = load.get_parameters().nominal_period
 
     cost = (
         + (data['filterchanges'] * data['filtercost'])
@@ -124,5 +359,583 @@ def synoptic_analysis(data=None, /, volume='medium'):
 #         )
 
 
+Fleet = namedtuple(
+    'Fleet', ('devices', 'counts', 'cadr', 'upfront', 'running', 'cost', 'noise'),
+    )
+
+
+def _decibels(power, /):
+    return 10 * np.log10(power)
+
+
+def _capacity_step(cadr, /):
+    cadr = cadr[np.isfinite(cadr) & (cadr > 0)]
+    if not len(cadr) or np.any(cadr != np.round(cadr)):
+        return 1
+    return int(np.gcd.reduce(cadr.astype(int)))
+
+
+class FleetOptimiser:
+
+    # Dynamic program over (units, capacity, noise) states. Capacity is
+    # counted in units of 'step', by default the gcd of the catalogue's
+    # integer CADRs (else 1), so capacities are exact; a coarser step
+    # floors them, which keeps fleets feasible but may miss the cheapest.
+    # Each unit's share of the noise budget is rounded up to 1/'noisesteps',
+    # so every fleet found is feasible; capacity is capped at the largest
+    # target so one table answers all smaller targets too.
+
+    __slots__ = (
+        'index', 'cadr', 'upfront', 'running', 'cost', 'loudness',
+        'maxunits', 'maxnoise', 'step', 'noisesteps', '_capsteps', '_tables',
+        )
+
+    def __init__(
+            self, data=None, /, maxunits=4, maxnoise=None,
+            step=None, noisesteps=20, period=None,
+            ):
+        params = load.get_parameters()
+        if period is None:
+            period = params.nominal_period
+        cat = catalogue(data)
+        self.index = cat.index
+        self.cadr = cat.cadr
+        self.upfront = cat.cost
+        self.running = (
+            cat.filtercost * cat.filterchanges
+            + cat.power * _KWH_PA * params.nominal_power_cost
+            )
+        self.cost = self.upfront + period * self.running
+        self.loudness = 10 ** (cat.noise / 10)
+        self.maxunits = int(maxunits)
+        self.maxnoise = None if maxnoise is None else float(maxnoise)
+        if step is None:
+            step = _capacity_step(self.cadr)
+        self.step = float(step)
+        self.noisesteps = 0 if maxnoise is None else int(noisesteps)
+        self._capsteps = None
+        self._tables = None
+
+    def _solve(self, capsteps, /):
+        nq = self.noisesteps + 1
+        ccap = np.floor(self.cadr / self.step).astype(int)
+        if self.maxnoise is None:
+            qcap = np.zeros(len(ccap), dtype=int)
+        else:
+            qcap = np.ceil(
+                self.loudness / 10 ** (self.maxnoise / 10) * self.noisesteps
+                ).astype(int)
+        usable = np.flatnonzero(
+            (qcap < nq) & (ccap > 0) & np.isfinite(self.cost)
+            )
+        qgrid = np.arange(nq)
+        dp = np.full((capsteps + 1, nq), np.inf)
+        dp[0, 0] = 0
+        tables = []
+        for _ in range(self.maxunits):
+            new = np.full_like(dp, np.inf)
+            choice = np.full(dp.shape, -1)
+            prevc = np.zeros(dp.shape, dtype=int)
+            prevq = np.zeros(dp.shape, dtype=int)
+            for model in usable:
+                cm, qm = ccap[model], qcap[model]
+                cand = np.full_like(dp, np.inf)
+                candc = np.zeros(dp.shape, dtype=int)
+                lo = max(capsteps - cm, 0)
+                if lo:
+                    cand[cm:capsteps, qm:] = dp[:lo, :nq-qm]
+                    candc[cm:capsteps, qm:] = np.arange(lo)[:, None]
+                block = dp[lo:, :nq-qm]
+                best = block.argmin(axis=0)
+                cand[capsteps, qm:] = block[best, np.arange(nq-qm)]
+                candc[capsteps, qm:] = lo + best
+                cand += self.cost[model]
+                better = cand < new
+                new[better] = cand[better]
+                choice[better] = model
+                prevc[better] = candc[better]
+                prevq[better] = np.broadcast_to(qgrid - qm, dp.shape)[better]
+            tables.append((new, choice, prevc, prevq))
+            dp = new
+        self._capsteps, self._tables = capsteps, tables
+
+    def _fleet(self, chosen, /):
+        models, counts = np.unique(chosen, return_counts=True)
+        loudness = (self.loudness[models] * counts).sum()
+        upfront = (self.upfront[models] * counts).sum()
+        running = (self.running[models] * counts).sum()
+        return Fleet(
+            tuple(self.index[models]),
+            tuple(counts.tolist()),
+            float((self.cadr[models] * counts).sum()),
+            float(upfront),
+            float(running),
+            float((self.cost[models] * counts).sum()),
+            float(_decibels(loudness)),
+            )
+
+    def query(self, cadr, /):
+        target = int(np.ceil(cadr / self.step))
+        if self._tables is None or target > self._capsteps:
+            self._solve(target)
+        bestcost, beststate = np.inf, None
+        for layer, (table, *_) in enumerate(self._tables):
+            region = table[target:]
+            flat = region.argmin()
+            if region.flat[flat] < bestcost:
+                bestcost = region.flat[flat]
+                cpos, qpos = np.unravel_index(flat, region.shape)
+                beststate = (layer, target + cpos, qpos)
+        if beststate is None:
+            return None
+        layer, cpos, qpos = beststate
+        chosen = []
+        for table, choice, prevc, prevq in reversed(self._tables[:layer+1]):
+            chosen.append(choice[cpos, qpos])
+            cpos, qpos = prevc[cpos, qpos], prevq[cpos, qpos]
+        return self._fleet(np.array(chosen))
+
+    def sweep(self, cadrs, /):
+        cadrs = tuple(cadrs)
+        if cadrs:
+            self._solve(int(np.ceil(max(cadrs) / self.step)))
+        return {cadr: self.query(cadr) for cadr in cadrs}
+
+
+def optimise_fleet(cadr, data=None, /, **kwargs):
+    return FleetOptimiser(data, **kwargs).query(cadr)
+
+
+def optimise_fleets(cadrs, data=None, /, **kwargs):
+    return FleetOptimiser(data, **kwargs).sweep(cadrs)
+
+
+class _DominanceSort:
+
+    # Generalised Jensen divide-and-conquer non-dominated sorting (Fortin
+    # et al. 2013, with Buzdalov and Shalyto's handling of ties), in
+    # O(n log^(d-1) n) for d objectives. Points are distinct and sorted
+    # lexicographically, so no point can dominate one before it; each
+    # point's rank is one more than the highest rank among its dominators.
+    # helper_a ranks points within a set agreeing on objectives past 'k';
+    # helper_b lifts the ranks of 'high' from those of 'low' where every
+    # low point is at most every high one on objectives past 'k'. Both
+    # split on objective 'k' at its median, sweep once two objectives are
+    # left, and compare by brute force once the sets are small.
+
+    # Largest sets (or pairs of sets) compared by brute force.
+    BRUTEA = 64
+    BRUTEB = 16384
+
+    __slots__ = ('values', 'ranks')
+
+    def __init__(self, values, /):
+        self.values = values
+        self.ranks = np.zeros(len(values), dtype=int)
+
+    def __call__(self, /):
+        npoints, ndims = self.values.shape
+        if ndims == 1:
+            self.ranks[:] = np.arange(npoints)
+        else:
+            self.helper_a(np.arange(npoints), ndims - 1)
+        return self.ranks
+
+    def _split(self, points, median, k, /):
+        vals = self.values[points, k]
+        return points[vals < median], points[vals == median], points[vals > median]
+
+    @staticmethod
+    def _median(vals, /):
+        return np.partition(vals, len(vals) // 2)[len(vals) // 2]
+
+    def helper_a(self, points, k, /):
+        if len(points) < 2:
+            return
+        if len(points) <= self.BRUTEA:
+            self.brute_a(points, k)
+        elif k == 1:
+            self.sweep_a(points)
+        else:
+            vals = self.values[points, k]
+            low, mid, high = self._split(points, self._median(vals), k)
+            self.helper_a(low, k)
+            self.helper_b(low, mid, k - 1)
+            self.helper_a(mid, k - 1)
+            self.helper_b(np.union1d(low, mid), high, k - 1)
+            self.helper_a(high, k)
+
+    def helper_b(self, low, high, k, /):
+        if not len(low) or not len(high):
+            return
+        if len(low) * len(high) <= self.BRUTEB or min(len(low), len(high)) == 1:
+            self.brute_b(low, high, k)
+            return
+        if k == 1:
+            self.sweep_b(low, high)
+            return
+        lowvals, highvals = self.values[low, k], self.values[high, k]
+        if lowvals.max() <= highvals.min():
+            self.helper_b(low, high, k - 1)
+        elif lowvals.min() <= highvals.max():
+            median = self._median(np.concatenate([lowvals, highvals]))
+            low1, mid1, high1 = self._split(low, median, k)
+            low2, mid2, high2 = self._split(high, median, k)
+            self.helper_b(low1, low2, k)
+            self.helper_b(low1, mid2, k - 1)
+            self.helper_b(mid1, mid2, k - 1)
+            self.helper_b(np.union1d(low1, mid1), high2, k - 1)
+            self.helper_b(high1, high2, k)
+
+    def brute_a(self, points, k, /):
+        vals = self.values[points, :k+1]
+        weak = np.all(vals[:, None] <= vals[None], axis=2)
+        dominates = np.triu(weak, 1)
+        ranks = self.ranks[points]
+        # Ranks settle after at most one pass per link of the longest chain.
+        while True:
+            lifted = np.maximum(
+                ranks, np.where(dominates, ranks[:, None] + 1, 0).max(axis=0),
+                )
+            if np.array_equal(lifted, ranks):
+                break
+            ranks = lifted
+        self.ranks[points] = ranks
+
+    def brute_b(self, low, high, k, /):
+        weak = np.all(
+            self.values[low, None, :k+1] <= self.values[None, high, :k+1], axis=2,
+            )
+        lifted = np.where(weak, self.ranks[low, None] + 1, 0).max(axis=0)
+        self.ranks[high] = np.maximum(self.ranks[high], lifted)
+
+    def sweep_a(self, points, /):
+        # A staircase of (second objective, rank), both strictly rising.
+        keys, levels = [], []
+        values, ranks = self.values, self.ranks
+        for point in points.tolist():
+            key = values[point, 1]
+            pos = bisect.bisect_right(keys, key)
+            rank = ranks[point]
+            if pos and levels[pos-1] >= rank:
+                rank = ranks[point] = levels[pos-1] + 1
+            _stair_insert(keys, levels, key, rank, pos)
+
+    def sweep_b(self, low, high, /):
+        keys, levels = [], []
+        values, ranks = self.values, self.ranks
+        islow = np.zeros(len(low) + len(high), dtype=bool)
+        merged = np.concatenate([low, high])
+        order = merged.argsort(kind='stable')
+        islow[:len(low)] = True
+        for point, fromlow in zip(merged[order].tolist(), islow[order].tolist()):
+            key = values[point, 1]
+            pos = bisect.bisect_right(keys, key)
+            if fromlow:
+                rank = ranks[point]
+                if not (pos and levels[pos-1] >= rank):
+                    _stair_insert(keys, levels, key, rank, pos)
+            elif pos and levels[pos-1] >= ranks[point]:
+                ranks[point] = levels[pos-1] + 1
+
+
+def _stair_insert(keys, levels, key, rank, pos, /):
+    # Inserts unless dominated, dropping the steps the new one dominates.
+    if pos and levels[pos-1] >= rank:
+        return
+    start = bisect.bisect_left(keys, key, 0, pos)
+    stop = pos
+    while stop < len(keys) and levels[stop] <= rank:
+        stop += 1
+    keys[start:stop] = [key]
+    levels[start:stop] = [rank]
+
+
+def dominance_ranks(values, /, maximise=()):
+
+    # Non-dominated sorting: each point's zero-based front (0 is the
+    # skyline), in O(n log n) for two objectives and O(n log^(d-1) n) for
+    # d > 2. Duplicate points share a front.
+
+    values = np.array(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    values[:, list(maximise)] *= -1
+    if not len(values):
+        return np.zeros(0, dtype=int)
+    unique, inverse = np.unique(values, axis=0, return_inverse=True)
+    return _DominanceSort(unique)()[inverse.reshape(-1)]
+
+
+SKYLINEMETRICS = ('running', 'upfront', 'noise', 'ach')
+
+
+@memoise('volume', 'parameters')
+def skyline(data=None, /, volume='medium'):
+
+    if isinstance(volume, str):
+        volume = load.get_volume_data()['levels'].loc[volume]
+
+    cat = catalogue(data)
+    running = (
+        cat.filtercost * cat.filterchanges
+        + cat.power * _KWH_PA * load.get_parameters().nominal_power_cost
+        )
+    data = pd.DataFrame(
+        dict(running=running, upfront=cat.cost, noise=cat.noise, ach=cat.cadr / volume),
+        index=cat.index,
+        )
+    data['rank'] = dominance_ranks(
+        data.loc[:, SKYLINEMETRICS].to_numpy(), maximise=(3,)
+        )
+
+    return data
+
+
+# Number of scenarios evaluated per vectorised pass of a sensitivity sweep.
+SENSITIVITYCHUNK = 4096
+
+
+# A sensitivity parameter drawn uniformly between 'low' and 'high'.
+Uniform = namedtuple('Uniform', ('low', 'high'))
+
+
+def _sample(spec, nominal, nsamples, rng, /):
+    if spec is None:
+        spec = Uniform(nominal / 2, nominal * 3 / 2)
+    if isinstance(spec, Uniform):
+        return rng.uniform(spec.low, spec.high, size=nsamples)
+    spec = np.asarray(spec, dtype=float).reshape(-1)
+    if len(spec) != nsamples:
+        raise ValueError("Sampled parameters must have length 'nsamples'.")
+    return spec
+
+
+def _sensitivity_chunk(inputs, powercosts, periods, top, /):
+    upfront, filtercost, powerkwh, ach, synfilter, cost = inputs
+    running = filtercost + powerkwh * powercosts[:, None]
+    total = upfront + periods[:, None] * running
+    ranks = total.argsort(axis=1).argsort(axis=1)
+    costeff = ach / ((synfilter + cost / periods[:, None]) / (24 * 365))
+    effranks = (-costeff).argsort(axis=1).argsort(axis=1)
+    return dict(
+        count=len(periods),
+        ranksum=ranks.sum(axis=0), ranksq=(ranks ** 2).sum(axis=0),
+        rankmin=ranks.min(axis=0), rankmax=ranks.max(axis=0),
+        best=(ranks == 0).sum(axis=0), top=(ranks < top).sum(axis=0),
+        costsum=total.sum(axis=0), costsq=(total ** 2).sum(axis=0),
+        costmin=total.min(axis=0), costmax=total.max(axis=0),
+        effranksum=effranks.sum(axis=0), effranksq=(effranks ** 2).sum(axis=0),
+        )
+
+
+def _merge_chunks(chunks, /):
+    out = None
+    for chunk in chunks:
+        if out is None:
+            out = dict(chunk)
+            continue
+        for key, val in chunk.items():
+            if key.endswith('min'):
+                out[key] = np.minimum(out[key], val)
+            elif key.endswith('max'):
+                out[key] = np.maximum(out[key], val)
+            else:
+                out[key] = out[key] + val
+    return out
+
+
+@memoise('volume', 'quality', 'parameters')
+def sensitivity(
+        data=None, /, volume='medium', quality='good', nsamples=10000,
+        powercost=None, period=None, seed=0, top=3, processes=None,
+        ):
+
+    # 'powercost' and 'period' are each None (uniform within +/-50% of the
+    # nominal parameter), a Uniform(low, high) range, or any other sequence
+    # of explicit samples, one per scenario.
+    # Devices are ranked per scenario by total cost over the period (0 is
+    # cheapest) and by synoptic cost efficiency (0 is most efficient).
+
+    if isinstance(volume, str):
+        volume = load.get_volume_data()['levels'].loc[volume]
+    if isinstance(quality, str):
+        quality = load.get_quality_data()['levels'].loc[quality]
+
+    nsamples = int(nsamples)
+    if nsamples < 1:
+        raise ValueError("Sensitivity analysis needs at least one sample.")
+
+    params = load.get_parameters()
+    rng = np.random.default_rng(seed)
+    powercosts = _sample(powercost, params.nominal_power_cost, nsamples, rng)
+    periods = _sample(period, params.nominal_period, nsamples, rng)
+
+    cat = catalogue(data)
+    # With a unit power price the kernel's power cost is the yearly kWh.
+    metrics = cost_kernel(cat, cat.cadr / volume / quality, 1.)
+    inputs = (
+        metrics['upfront'], metrics['filter'], metrics['power'],
+        cat.cadr / volume, cat.filterchanges * cat.filtercost, cat.cost,
+        )
+
+    bounds = range(0, nsamples, SENSITIVITYCHUNK)
+    chunks = (
+        (inputs, powercosts[lo:lo+SENSITIVITYCHUNK], periods[lo:lo+SENSITIVITYCHUNK], top)
+        for lo in bounds
+        )
+    if processes is None or len(bounds) < 2:
+        totals = _merge_chunks(_sensitivity_chunk(*args) for args in chunks)
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            totals = _merge_chunks(
+                executor.map(_sensitivity_chunk, *zip(*chunks))
+                )
+
+    count = totals['count']
+    meanrank = totals['ranksum'] / count
+    meancost = totals['costsum'] / count
+    meaneffrank = totals['effranksum'] / count
+    return pd.DataFrame(
+        dict(
+            meanrank=meanrank,
+            stdrank=np.sqrt(np.maximum(totals['ranksq'] / count - meanrank ** 2, 0)),
+            minrank=totals['rankmin'],
+            maxrank=totals['rankmax'],
+            pbest=totals['best'] / count,
+            ptop=totals['top'] / count,
+            meancost=meancost,
+            stdcost=np.sqrt(np.maximum(totals['costsq'] / count - meancost ** 2, 0)),
+            mincost=totals['costmin'],
+            maxcost=totals['costmax'],
+            meaneffrank=meaneffrank,
+            stdeffrank=np.sqrt(np.maximum(
+                totals['effranksq'] / count - meaneffrank ** 2, 0
+                )),
+            ),
+        index=cat.index,
+        )
+
+
+Update = namedtuple(
+    'Update', ('results', 'buckets', 'grid', 'charts', 'synoptic'),
+    )
+
+# Cost columns that end up on the rendered charts.
+_CHARTED = ('noise', 'upfront', 'power', 'filter', 'nunits')
+
+
+def _row_keys(index, /):
+    return pd.Index(map(load.row_key, index), tupleize_cols=False)
+
+
+def _update_long_form(previous, fresh, new, affected, reshuffled, /):
+
+    # Splices 'fresh' rows for the affected devices into 'previous', a
+    # long-form frame with outer levels ahead of the catalogue's, and
+    # returns it with the outer keys whose charted values changed.
+
+    nouter = previous.index.nlevels - new.index.nlevels
+    outer = list(range(nouter))
+    prevkeys = _row_keys(previous.index.droplevel(outer))
+    kept = previous.loc[~prevkeys.isin(affected)]
+
+    eligible = _eligible(new).index
+    levels = tuple(
+        (name, previous.index.unique(name).to_numpy())
+        for name in previous.index.names[:nouter]
+        )
+    shape = (*(len(vals) for _, vals in levels), len(eligible))
+    target = _long_form(
+        {key: np.zeros(shape) for key in COSTMETRICS}, levels, eligible,
+        ).index
+    results = pd.concat([kept, fresh]).reindex(target)
+    results['nunits'] = results['nunits'].astype(int)
+
+    if reshuffled:
+        keys = previous.index.droplevel(list(range(nouter, previous.index.nlevels)))
+        return results, tuple(sorted(set(keys.tolist())))
+    # Excluded manufacturers never reach the cost charts.
+    before = drop_excluded(previous.loc[prevkeys.isin(affected), list(_CHARTED)])
+    after = drop_excluded(fresh.loc[:, list(_CHARTED)])
+    before, after = before.align(after, join='outer')
+    differs = ~np.isclose(
+        before.to_numpy(dtype=float), after.to_numpy(dtype=float),
+        rtol=1e-12, atol=0, equal_nan=True,
+        ).all(axis=1)
+    keys = before.index.droplevel(list(range(nouter, before.index.nlevels)))
+    return results, tuple(sorted(set(keys[differs].tolist())))
+
+
+def update_cost_analysis_by_cadrs(previous, old, new, /, delta=None, grid=None):
+
+    # Brings 'previous' (from cost_analysis_by_cadrs over the 'old'
+    # catalogue) and optionally 'grid' (from cost_grid over it) up to date
+    # with 'new' by re-running the kernel on the added and modified devices
+    # only, and reports which CADR buckets, which (volume, quality) charts
+    # and whether the synoptic chart actually differ. Parameter and level
+    # changes are not catalogue edits: those need a full recompute.
+
+    if delta is None:
+        delta = load.row_deltas(old, new)
+
+    touched = set(delta.added) | set(delta.modified)
+    sub = new.loc[_row_keys(new.index).isin(touched)]
+    affected = touched | set(delta.removed)
+
+    # A device entering or leaving the eligible set changes every chart.
+    oldeligible = set(map(load.row_key, _eligible(old).index))
+    neweligible = set(map(load.row_key, _eligible(new).index))
+    reshuffled = bool((oldeligible ^ neweligible) & affected)
+
+    fresh = cost_analysis_by_cadrs(previous.index.unique('cadr').to_numpy(), sub)
+    results, buckets = _update_long_form(
+        previous, fresh, new, affected, reshuffled,
+        )
+    if grid is None:
+        charts = None
+    else:
+        fresh = cost_grid(
+            sub,
+            grid.index.unique('volume').to_numpy(),
+            grid.index.unique('quality').to_numpy(),
+            )
+        grid, charts = _update_long_form(grid, fresh, new, affected, reshuffled)
+
+    synold = synoptic_analysis(old.loc[_row_keys(old.index).isin(affected)])
+    synnew = synoptic_analysis(sub)
+    synold, synnew = synold.align(synnew, join='outer')
+    synoptic = not np.isclose(
+        synold.to_numpy(dtype=float), synnew.to_numpy(dtype=float),
+        rtol=1e-12, atol=0, equal_nan=True,
+        ).all()
+
+    return Update(results, buckets, grid, charts, synoptic)
+
+
+def _results_path():
+    return os.path.join(load.snapshotsdir, 'results.pkl')
+
+
+def write_results(digest, /, **results):
+    # Keeps one run's results for the catalogue with fingerprint 'digest',
+    # for the next run to update incrementally instead of recomputing.
+    os.makedirs(load.snapshotsdir, exist_ok=True)
+    load.write_atomic(
+        _results_path(), pickle.dumps((ANALYSIS_VERSION, digest, results)),
+        )
+
+
+def read_results(digest, /):
+    try:
+        with open(_results_path(), mode='rb') as file:
+            version, stored, results = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        raise KeyError(digest)
+    if version != ANALYSIS_VERSION or stored != digest:
+        raise KeyError(digest)
+    return results
+
+
 ###############################################################################
 ###############################################################################
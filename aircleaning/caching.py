@@ -0,0 +1,56 @@
+###############################################################################
+''''''
+###############################################################################
+
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+
+    # A thread-safe mapping holding at most 'maxsize' entries, evicting the
+    # least recently used first; get() raises KeyError on a miss.
+
+    __slots__ = ('_data', '_lock', '_maxsize')
+
+    def __init__(self, maxsize, /):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._maxsize = int(maxsize)
+
+    @property
+    def maxsize(self, /):
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, val, /):
+        self._maxsize = int(val)
+        with self._lock:
+            self._evict()
+
+    def __len__(self, /):
+        return len(self._data)
+
+    def _evict(self, /):
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, /):
+        with self._lock:
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value, /):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._evict()
+
+    def clear(self, /):
+        with self._lock:
+            self._data.clear()
+
+
+###############################################################################
+###############################################################################
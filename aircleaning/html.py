@@ -4,10 +4,40 @@
 
 
 import os as _os
-import itertools as _itertools
+import io as _io
 from collections import abc as _collabc
 
 
+# Characters gathered before each write to the underlying sink.
+WRITEBUFFER = 1 << 16
+
+
+def write_lines(lines, file, /, standard='  ', buffersize=WRITEBUFFER):
+    # Streams (indent, text) lines into any text sink, batching the writes
+    # through one reused buffer rather than building the whole document.
+    write = file.write
+    buffer = []
+    size = 0
+    indents = {}
+    for indent, text in lines:
+        if text:
+            try:
+                prefix = indents[indent]
+            except KeyError:
+                prefix = indents[indent] = indent*standard
+            buffer.append(prefix)
+            buffer.append(text)
+            size += len(prefix) + len(text)
+        buffer.append('\n')
+        size += 1
+        if size >= buffersize:
+            write(''.join(buffer))
+            buffer.clear()
+            size = 0
+    if buffer:
+        write(''.join(buffer))
+
+
 class HTML:
 
     STANDARD_INDENT = '  '
@@ -85,23 +115,22 @@ class HTML:
                 out.append(style)
         return tuple(out)
 
+    def yield_html_lines(self, /):
+        yield from self.yield_boilerplate()
+        yield from self.yield_lines()
+        yield from self.yield_initialiser()
+
+    def write_html(self, file, /):
+        write_lines(self.yield_html_lines(), file, self.STANDARD_INDENT)
+
     def _repr_html_(self, /):
-        standard = self.STANDARD_INDENT
-        out = []
-        for indent, text in _itertools.chain(
-                self.yield_boilerplate(),
-                self.yield_lines(),
-                self.yield_initialiser(),
-                ):
-            if text:
-                out.append(indent*standard)
-                out.append(text)
-            out.append('\n')
-        return ''.join(out)
+        out = _io.StringIO()
+        self.write_html(out)
+        return out.getvalue()
 
     def save_html(self, /, name, path='.'):
         with open(_os.path.join(path, name) + '.html', mode='w') as file:
-            file.write(self._repr_html_())
+            self.write_html(file)
         return
 
 
@@ -3,11 +3,93 @@
 ###############################################################################
 
 
+import os
+import io
+import csv
+import json
+import time
+import hashlib
+import gzip
+import queue
+import threading
+import http.client
+import urllib.request
+import urllib.error
+import urllib.parse
+from collections import namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from functools import cache
 
 import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Anything that can go wrong with the optional columnar snapshots; on any
+# of these the sheet is parsed from CSV instead.
+COLUMNAR_ERRORS = (ImportError, OSError, ValueError, TypeError, KeyError)
+if pa is not None:
+    COLUMNAR_ERRORS += (pa.ArrowException,)
+
+
+repodir = os.path.dirname(os.path.dirname(__file__))
+snapshotsdir = os.environ.get(
+    'AIRCLEANING_SNAPSHOTS', os.path.join(repodir, '.snapshots')
+    )
+
+SHEETID = '1-txu_2XXChdZ8USBgDq7sndrsi_UjNdlkGmLzk7jxi4'
+SHEETURL = os.environ.get(
+    'AIRCLEANING_SHEETURL',
+    "https://docs.google.com/spreadsheets/d/{sheetid}"
+    "/gviz/tq?tqx=out:csv&sheet={sheetname}",
+    )
+TIMEOUT = 30
+MAXREDIRECTS = 5
+
+DATASETS = ('main', 'volume', 'quality', 'parameters')
+
+# Number of distinct versions of each sheet kept in the snapshot history.
+HISTORYLENGTH = 32
+
+# Bump whenever sheet processing changes, so that stale columnar snapshots
+# are rebuilt rather than loaded.
+PROCESSING_VERSION = 2
+
+# Cached frames are handed out as shallow views. Copy-on-write (always on
+# from pandas 3, opt-in before) keeps callers from mutating the cache
+# through them; without it their numpy buffers are made read-only instead,
+# so that writes through a view raise rather than corrupt the cache. The
+# option is the caller's to set: it is never switched on from here.
+PANDAS3 = int(pd.__version__.split('.')[0]) >= 3
+
+
+def copy_on_write():
+    if PANDAS3:
+        return True
+    try:
+        return pd.get_option('mode.copy_on_write') is True
+    except (AttributeError, KeyError):
+        return False
+
+
+def _freeze(data, /):
+    try:
+        arrays = data._mgr.arrays
+    except AttributeError:
+        return
+    for arr in arrays:
+        if isinstance(arr, np.ndarray):
+            arr.flags.writeable = False
+
+
+# When set, sheets are served from the snapshot store without touching
+# the network (see also the '--offline' command line flag).
+OFFLINE = bool(os.environ.get('AIRCLEANING_OFFLINE'))
+
 
 def process_colname(colname, /):
     names = colname.split(' ')
@@ -21,104 +103,639 @@ def process_colname(colname, /):
     return ''.join(map(str.lower, names)), None
 
 
-def pull_data(sheetname, sheetid='1-txu_2XXChdZ8USBgDq7sndrsi_UjNdlkGmLzk7jxi4'):
+def sheet_url(sheetname, sheetid=SHEETID, /):
+    return SHEETURL.format(sheetid=sheetid, sheetname=sheetname)
 
-    data = pd.read_csv(
-        f"https://docs.google.com/spreadsheets/d/{sheetid}"
-        f"/gviz/tq?tqx=out:csv&sheet={sheetname}"
-        )
+
+def _snapshot_paths(sheetname, /):
+    base = os.path.join(snapshotsdir, sheetname)
+    return base + '.csv', base + '.json'
+
+
+def write_atomic(path, content, /):
+    # Unique per process, so that concurrent writers never share a file.
+    temppath = f"{path}.{os.getpid()}.tmp"
+    with open(temppath, mode='wb') as file:
+        file.write(content)
+    os.replace(temppath, path)
+
+
+def read_snapshot(sheetname, /):
+    csvpath, metapath = _snapshot_paths(sheetname)
+    with open(metapath, mode='r') as file:
+        meta = json.load(file)
+    with open(csvpath, mode='rb') as file:
+        content = file.read()
+    if hashlib.sha256(content).hexdigest() != meta['sha256']:
+        raise ValueError(f"Snapshot of sheet '{sheetname}' is corrupt.")
+    return content, meta
+
+
+def write_snapshot(sheetname, meta, content=None, /):
+    os.makedirs(snapshotsdir, exist_ok=True)
+    csvpath, metapath = _snapshot_paths(sheetname)
+    if content is not None:
+        write_atomic(csvpath, content)
+    write_atomic(metapath, json.dumps(meta, indent=2).encode())
+
+
+def snapshot_info(sheetname, /):
+    return read_snapshot(sheetname)[1]
+
+
+def _history_dir(sheetname, /):
+    return os.path.join(snapshotsdir, 'history', sheetname)
+
+
+def list_versions(sheetname, /):
+    try:
+        names = os.listdir(_history_dir(sheetname))
+    except FileNotFoundError:
+        return ()
+    return tuple(sorted(
+        name[:-4] for name in names if name.endswith('.csv')
+        ))
+
+
+def archive_version(sheetname, content, meta, /):
+    histdir = _history_dir(sheetname)
+    os.makedirs(histdir, exist_ok=True)
+    version = f"{meta['fetched']:017.6f}_{meta['sha256'][:16]}"
+    write_atomic(os.path.join(histdir, version) + '.csv', content)
+    for old in list_versions(sheetname)[:-HISTORYLENGTH]:
+        os.remove(os.path.join(histdir, old) + '.csv')
+    return version
+
+
+def read_version(sheetname, version=-1, /):
+    if isinstance(version, int):
+        versions = list_versions(sheetname)
+        try:
+            version = versions[version]
+        except IndexError:
+            raise KeyError(
+                f"Sheet '{sheetname}' has only {len(versions)} versions."
+                )
+    with open(os.path.join(_history_dir(sheetname), version) + '.csv', 'rb') as file:
+        return file.read()
+
+
+class Session:
+
+    __slots__ = ('_pools', '_lock', 'timeout')
+
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, key, /):
+        with self._lock:
+            try:
+                return self._pools[key]
+            except KeyError:
+                pool = self._pools[key] = queue.LifoQueue()
+                return pool
+
+    def _connect(self, scheme, netloc, timeout, /):
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=timeout)
+        return http.client.HTTPConnection(netloc, timeout=timeout)
+
+    def _exchange(self, conn, target, headers, timeout, /):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        conn.request('GET', target, headers=headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def _get(self, url, headers, timeout, /):
+        parts = urllib.parse.urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        pool = self._pool((parts.scheme, parts.netloc))
+        try:
+            conn, reused = pool.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._connect(parts.scheme, parts.netloc, timeout), False
+        try:
+            response, body = self._exchange(conn, target, headers, timeout)
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection: retry fresh.
+            conn = self._connect(parts.scheme, parts.netloc, timeout)
+            try:
+                response, body = self._exchange(conn, target, headers, timeout)
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+        if response.will_close:
+            conn.close()
+        else:
+            pool.put(conn)
+        return response, body
+
+    def _urlopen(self, url, headers, timeout, /):
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return (
+                    response.status or 200,
+                    dict(response.headers.items()),
+                    response.read(),
+                    )
+        except urllib.error.HTTPError as exc:
+            if exc.code == 304:
+                return 304, dict(exc.headers.items()), b''
+            raise
+
+    def request(self, url, headers=None, /, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        headers = dict(headers or ())
+        if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+            return self._urlopen(url, headers, timeout)
+        headers.setdefault('Accept-Encoding', 'gzip')
+        for _ in range(MAXREDIRECTS + 1):
+            response, body = self._get(url, headers, timeout)
+            status = response.status
+            if status in (301, 302, 303, 307, 308):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            respheaders = dict(response.getheaders())
+            if status >= 400:
+                raise urllib.error.HTTPError(
+                    url, status, response.reason, response.msg, None
+                    )
+            if response.getheader('Content-Encoding', '').lower() == 'gzip':
+                body = gzip.decompress(body)
+            return status, respheaders, body
+        raise urllib.error.URLError(f"Too many redirects fetching {url}")
+
+    def close(self, /):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+
+
+@cache
+def get_session():
+    return Session()
+
+
+@cache
+def fetch_sheet(sheetname, sheetid=SHEETID, /):
+
+    try:
+        content, meta = read_snapshot(sheetname)
+    except (OSError, ValueError, KeyError):
+        content, meta = None, {}
+
+    if OFFLINE:
+        if content is None:
+            raise FileNotFoundError(
+                f"No snapshot of sheet '{sheetname}' is available offline."
+                )
+        return content
+
+    url = sheet_url(sheetname, sheetid)
+    headers = {}
+    if content is not None and meta.get('url') == url:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('lastmodified'):
+            headers['If-Modified-Since'] = meta['lastmodified']
+
+    status, respheaders, body = \
+        get_session().request(url, headers, timeout=TIMEOUT)
+    respheaders = {key.lower(): val for key, val in respheaders.items()}
+    now = time.time()
+
+    if status == 304:
+        changed = False
+    else:
+        digest = hashlib.sha256(body).hexdigest()
+        changed = content is None or digest != meta.get('sha256')
+        if changed:
+            content = body
+            meta = dict(url=url, sha256=digest, fetched=now)
+    meta['checked'] = now
+    meta['etag'] = respheaders.get('etag', meta.get('etag'))
+    meta['lastmodified'] = \
+        respheaders.get('last-modified', meta.get('lastmodified'))
+
+    write_snapshot(sheetname, meta, (content if changed else None))
+    if changed:
+        archive_version(sheetname, content, meta)
+    return content
+
+
+def fetch_sheets(sheetnames=DATASETS, /, sheetid=SHEETID, maxworkers=None):
+    sheetnames = tuple(sheetnames)
+    with ThreadPoolExecutor(maxworkers or len(sheetnames) or 1) as executor:
+        contents = executor.map(
+            lambda sheetname: fetch_sheet(sheetname, sheetid), sheetnames
+            )
+        return dict(zip(sheetnames, contents))
+
+
+Field = namedtuple(
+    'Field', ('dtype', 'unit', 'parser', 'rounding'),
+    defaults=(None, None, None, None),
+    )
+
+
+def parse_money(val, /):
+    val = val.strip().replace('$', '').replace(',', '')
+    return float(val) if val else np.nan
+
+
+def parse_flag(val, /):
+    val = val.strip().lower()
+    # Blank cells have always read as set (the old astype(bool) on NaN);
+    # keep it that way, so an unfilled 'ionising' or 'uv' still excludes.
+    if not val:
+        return True
+    return val in ('true', 'yes', 'y', '1')
+
+
+FLOAT_ROUNDING = 4
+
+MAIN_SCHEMA = dict(
+    manufacturer=Field('category'),
+    model=Field(str),
+    name=Field(str),
+    notes=Field(str),
+    cost=Field(float, '$', parse_money, 2),
+    filtercost=Field(float, '$', parse_money, FLOAT_ROUNDING),
+    filterchanges=Field(float, rounding=FLOAT_ROUNDING),
+    cadr=Field(float, 'm3/h', rounding=FLOAT_ROUNDING),
+    power=Field(float, 'W', rounding=FLOAT_ROUNDING),
+    noise=Field(float, 'dB', rounding=FLOAT_ROUNDING),
+    hepafilter=Field(bool, parser=parse_flag),
+    prefilter=Field(bool, parser=parse_flag),
+    charcoalfilter=Field(bool, parser=parse_flag),
+    ionising=Field(bool, parser=parse_flag),
+    uv=Field(bool, parser=parse_flag),
+    )
+
+LEVELS_SCHEMA = dict(
+    names=Field(str, parser=str.lower),
+    levels=Field(float, rounding=FLOAT_ROUNDING),
+    )
+
+
+def parse_sheet(content, /, schema=None):
+
+    header = next(csv.reader(io.StringIO(
+        content.decode('utf-8-sig').split('\n', 1)[0]
+        )))
     units = {}
     columns = []
-    for col in data.columns:
+    for col in header:
         name, unit = process_colname(col)
-        units[name] = unit
         columns.append(name)
-    data.columns = columns
+        units[name] = unit
+
+    if schema is None:
+        schema = {}
+    dtypes, converters, decimals = {}, {}, {}
+    for name in columns:
+        try:
+            field = schema[name]
+        except KeyError:
+            continue
+        if field.parser is None:
+            if field.dtype is not None:
+                dtypes[name] = field.dtype
+        else:
+            converters[name] = field.parser
+        if field.rounding is not None:
+            decimals[name] = field.rounding
+        if units[name] is None:
+            units[name] = field.unit
+
+    data = pd.read_csv(
+        io.BytesIO(content), header=0, names=columns,
+        dtype=(dtypes or None), converters=(converters or None),
+        )
+    # Columns the schema does not know about keep the old blanket rounding.
+    for name in columns:
+        if name not in schema and data[name].dtype == np.dtype('float64'):
+            decimals[name] = FLOAT_ROUNDING
+    if decimals:
+        data = data.round(decimals)
     data.attrs['units'] = units
     return data
 
 
+def pull_data(sheetname, sheetid=SHEETID, schema=None):
+    return parse_sheet(fetch_sheet(sheetname, sheetid), schema)
+
+
+def _columnar_path(sheetname, /):
+    return os.path.join(snapshotsdir, sheetname + '.arrow')
+
+
+def write_columnar(sheetname, data, digest, /):
+    if pa is None:
+        raise ImportError("Columnar snapshots require pyarrow.")
+    table = pa.Table.from_pandas(data, preserve_index=True)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'aircleaning'] = json.dumps(dict(
+        version=PROCESSING_VERSION,
+        digest=digest,
+        units=data.attrs.get('units', {}),
+        )).encode()
+    table = table.replace_schema_metadata(metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.makedirs(snapshotsdir, exist_ok=True)
+    write_atomic(_columnar_path(sheetname), sink.getvalue())
+
+
+def read_columnar(sheetname, digest=None, /):
+    if pa is None:
+        raise ImportError("Columnar snapshots require pyarrow.")
+    with pa.memory_map(_columnar_path(sheetname), 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    meta = json.loads(table.schema.metadata[b'aircleaning'])
+    if meta['version'] != PROCESSING_VERSION:
+        raise ValueError(f"Columnar snapshot of '{sheetname}' is outdated.")
+    if digest is not None and meta['digest'] != digest:
+        raise ValueError(f"Columnar snapshot of '{sheetname}' is stale.")
+    # Numeric columns without nulls stay backed by the mapped pages.
+    data = table.to_pandas(split_blocks=True)
+    data.attrs['units'] = meta['units']
+    return data
+
+
+def view(data, /, copy=False):
+    if copy:
+        return data.copy()
+    if not copy_on_write():
+        _freeze(data)
+    return data.copy(deep=False)
+
+
 @cache
 def pull_update_data():
     ...
 
 
-@cache
-def pull_main_data():
+def process_main_data(content, /):
+    return (
+        parse_sheet(content, MAIN_SCHEMA)
+        .set_index(['manufacturer', 'model'])
+        )
+
+
+def process_volume_data(content, /):
+    return parse_sheet(content, LEVELS_SCHEMA).set_index('names')
+
+
+def process_quality_data(content, /):
+    return parse_sheet(content, LEVELS_SCHEMA).set_index('names')
 
-    data = pull_data('main')
 
-    data = data.set_index(['manufacturer', 'model'])
+def process_parameters_data(content, /):
+    return parse_sheet(content).set_index('name')
 
-    data['cost'] = data['cost'].replace("[$,]", "", regex=True).astype(float).round(2)
-    data['filtercost'] = data['filtercost'].replace("[$,]", "", regex=True).astype(float)
 
-    for key in ('hepafilter', 'prefilter', 'charcoalfilter', 'ionising', 'uv'):
-        data[key] = data[key].astype(bool)
+PROCESSORS = dict(
+    main=process_main_data,
+    volume=process_volume_data,
+    quality=process_quality_data,
+    parameters=process_parameters_data,
+    )
 
-    for col in data:
-        if data[col].dtype == np.dtype('float64'):
-            data[col] = data[col].round(4)
 
+def pull_processed(sheetname, /):
+    content = fetch_sheet(sheetname)
+    digest = hashlib.sha256(content).hexdigest()
+    try:
+        return read_columnar(sheetname, digest)
+    except COLUMNAR_ERRORS:
+        pass
+    data = PROCESSORS[sheetname](content)
+    try:
+        write_columnar(sheetname, data, digest)
+    except ImportError:
+        pass
+    except COLUMNAR_ERRORS as exc:
+        print(f"Could not write columnar snapshot of '{sheetname}': {exc!r}")
     return data
 
 
-def get_main_data():
-    return pull_main_data().copy()
+@cache
+def pull_main_data():
+    return pull_processed('main')
+
+
+def get_main_data(copy=False):
+    return view(pull_main_data(), copy)
 
 
 @cache
 def pull_volume_data():
+    return pull_processed('volume')
 
-    data = pull_data('volume')
-    data['names'] = data['names'].apply(str.lower)
-    data['levels'] = data['levels'].astype(float)
-    data = data.set_index('names')
 
-    for col in data:
-        if data[col].dtype == np.dtype('float64'):
-            data[col] = data[col].round(4)
+def get_volume_data(copy=False):
+    return view(pull_volume_data(), copy)
 
-    return data
+
+@cache
+def pull_quality_data():
+    return pull_processed('quality')
 
 
-def get_volume_data():
-    return pull_volume_data().copy()
+def get_quality_data(copy=False):
+    return view(pull_quality_data(), copy)
 
 
 @cache
-def pull_quality_data():
+def pull_parameters_data():
+    return pull_processed('parameters')
 
-    data = pull_data('quality')
-    data['names'] = data['names'].apply(str.lower)
-    data['levels'] = data['levels'].astype(float)
-    data = data.set_index('names')
 
-    for col in data:
-        if data[col].dtype == np.dtype('float64'):
-            data[col] = data[col].round(4)
+def get_parameters_data(copy=False):
+    return view(pull_parameters_data(), copy)
+
+
+def _parameter_key(name, /):
+    return '_'.join(str(name).lower().split())
+
+
+def _parameter_value(val, /):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return val
 
-    return data
 
+class Parameters(Mapping):
 
-def get_quality_data():
-    return pull_quality_data().copy()
+    __slots__ = ('_values',)
+
+    def __init__(self, values, /):
+        object.__setattr__(self, '_values', {
+            _parameter_key(key): _parameter_value(val)
+            for key, val in dict(values).items()
+            })
+
+    def __getitem__(self, key, /):
+        return self._values[_parameter_key(key)]
+
+    def __iter__(self, /):
+        return iter(self._values)
+
+    def __len__(self, /):
+        return len(self._values)
+
+    def __getattr__(self, name, /):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, val, /):
+        raise AttributeError(f"{type(self).__name__} is read-only.")
+
+    def __reduce__(self, /):
+        return type(self), (self._values,)
+
+    def __repr__(self, /):
+        return f"{type(self).__name__}({self._values!r})"
 
 
 @cache
-def pull_parameters_data():
-    data = (
-        pull_data('parameters')
-        .set_index('name')
+def get_parameters():
+    return Parameters(pull_parameters_data()['value'])
+
+
+def pull_all_data():
+    fetch_sheets(DATASETS)
+    return dict(
+        main=pull_main_data(),
+        volume=pull_volume_data(),
+        quality=pull_quality_data(),
+        parameters=pull_parameters_data(),
         )
-    for col in data:
-        if data[col].dtype == np.dtype('float64'):
-            data[col] = data[col].round(4)
-    return data
 
 
-def get_parameters_data():
-    return pull_parameters_data().copy()
+Fingerprint = namedtuple('Fingerprint', ('digest', 'rows'))
+
+Delta = namedtuple('Delta', ('added', 'removed', 'modified'))
+
+
+def row_key(key, /):
+    return tuple(map(str, key)) if isinstance(key, tuple) else (str(key),)
+
+
+def fingerprint(data, /):
+    rows = pd.util.hash_pandas_object(data, index=True)
+    m = hashlib.sha256()
+    m.update(json.dumps((
+        list(map(str, data.index.names)),
+        list(map(str, data.columns)),
+        list(map(str, data.dtypes)),
+        )).encode())
+    m.update(rows.to_numpy().tobytes())
+    return Fingerprint(
+        m.hexdigest(),
+        dict(zip(map(row_key, rows.index), map('{:016x}'.format, rows))),
+        )
+
+
+def fingerprints():
+    return {
+        name: fingerprint(data)
+        for name, data in pull_all_data().items()
+        }
+
+
+def make_token(prints, /):
+    return dict(
+        version=1,
+        datasets={
+            name: dict(digest=fp.digest, rows=sorted(map(list, fp.rows.items())))
+            for name, fp in prints.items()
+            },
+        )
+
+
+def read_token(path, /):
+    try:
+        with open(path, mode='r') as file:
+            token = json.load(file)
+    except (OSError, ValueError):
+        return dict(version=1, datasets={})
+    return token
+
+
+def write_token(token, path, /):
+    write_atomic(path, json.dumps(token).encode())
+
+
+def _token_rows(entry, /):
+    return {tuple(key): digest for key, digest in entry['rows']}
+
+
+def compare_rows(old, new, /):
+    return Delta(
+        tuple(sorted(new.keys() - old.keys())),
+        tuple(sorted(old.keys() - new.keys())),
+        tuple(sorted(
+            key for key in old.keys() & new.keys() if old[key] != new[key]
+            )),
+        )
+
+
+def compare_tokens(old, new, /):
+    olddsets, newdsets = old['datasets'], new['datasets']
+    changes = {}
+    for name, entry in newdsets.items():
+        try:
+            oldentry = olddsets[name]
+        except KeyError:
+            changes[name] = Delta(tuple(sorted(_token_rows(entry))), (), ())
+            continue
+        if oldentry['digest'] != entry['digest']:
+            changes[name] = compare_rows(
+                _token_rows(oldentry), _token_rows(entry)
+                )
+    for name in olddsets.keys() - newdsets.keys():
+        changes[name] = Delta((), tuple(sorted(_token_rows(olddsets[name]))), ())
+    return changes
+
+
+def load_version(sheetname, version=-1, /):
+    return PROCESSORS[sheetname](read_version(sheetname, version))
+
+
+def row_deltas(previous, current, /):
+    return compare_rows(fingerprint(previous).rows, fingerprint(current).rows)
+
+
+def changed_rows(sheetname, /, since=-2, until=-1):
+    current = load_version(sheetname, until)
+    try:
+        previous = load_version(sheetname, since)
+    except KeyError:
+        return Delta(tuple(sorted(fingerprint(current).rows)), (), ())
+    return row_deltas(previous, current)
+
+
+def changed_devices(since=-2, until=-1):
+    return changed_rows('main', since=since, until=until)
 
 
 ###############################################################################
@@ -8,6 +8,9 @@ import operator
 from datetime import date
 import itertools
 import math
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 import matplotlib as mpl
@@ -27,76 +30,7 @@ productsdir = os.path.join(repodir, 'products')
 def cost_analysis(data=None, /, volume='medium', quality='some', path=productsdir, name='default'):
 
     data = analyse.cost_analysis(data, volume, quality)
-    data = data.sort_values('upfront')
-    # data = data.loc[data['nunits'] < 6]
-    data = data.drop('Dyson', level='manufacturer')
-    data['fullname'] = tuple(map(
-        ''.join, zip(
-            map(' '.join, data.index),
-            (f' (x{n})' if n>1 else '' for n in data['nunits']),
-            )
-        ))
-    dollarlabels = tuple(map(' + '.join, zip(
-        data['upfront'].astype(int).apply('${:,}'.format),
-        data['power'].astype(int).apply('{:,} pa'.format),
-        data['filter'].astype(int).apply('{:,} pa'.format),
-        )))
-
-    plt.rcdefaults()
-    fig, (ax1, ax2) = \
-        plt.subplots(ncols=2, gridspec_kw={'width_ratios': [2, 1]})
-
-    fig.set_size_inches(8, 0.3 * len(data))
-    fig.set_tight_layout(True)
-
-    y_pos = np.arange(len(data))
-
-    innerbars = ax1.barh(
-        y_pos, data['upfront'], color='#4074B2'
-        )
-
-    gap = (data['upfront'] + data['filter'] + data['power']).max() / 30
-    powerbars = ax1.barh(
-        y_pos, data['power'], left=data['upfront']+gap, color='#E77052'
-        )
-    filterbars = ax1.barh(
-        y_pos, data['filter'], left=data['upfront']+data['power']+gap*2, color='#59B17F'
-        )
-    ax1.set_yticks(y_pos, labels=data['fullname'])
-    ax1.invert_yaxis()  # labels read top-to-bottom
-    ax1.set_xlabel('Dollars ($)')
-    ax1.set_title('Cost')
-    ax1.bar_label(
-        filterbars, dollarlabels,
-        label_type='edge', padding=8, fmt='$%d', color='grey'
-        )
-    ax1.spines['top'].set_visible(False)
-    ax1.spines['right'].set_visible(False)
-    ax1.spines['left'].set_visible(False)
-    ax1.tick_params(axis='y', which='both', left=False)
-    ax1.legend(
-        [innerbars, powerbars, filterbars],
-        ['Upfront', 'Yearly filter', 'Yearly power'],
-        ncol=2,
-        )
-
-    noisecmap = load.get_parameters_data().loc['noise cmap', 'value']
-    noisecolours = tuple(
-        map(plt.get_cmap(noisecmap), Normalize(20, 80)(data['noise']))
-        )
-    bars = ax2.barh(y_pos, data['noise'], color=noisecolours)
-    ax2.set_yticks(y_pos, labels=[])
-    ax2.invert_yaxis()  # labels read top-to-bottom
-    ax2.set_xlabel('Decibels (dB)')
-    ax2.set_title('Noise')
-    ax2.set_xlim(20)
-    ax2.bar_label(bars, label_type='edge', padding=8, fmt='%d dB', color='grey')
-    ax2.spines['top'].set_visible(False)
-    ax2.spines['right'].set_visible(False)
-    ax2.spines['left'].set_visible(False)
-    ax2.tick_params(axis='y', which='both', left=False)
-
-    plt.savefig(os.path.join(path, name) + '.png')
+    plot_cost_analysis(data, path=path, name=name)
 
 
 def cost_analysis_by_cadr(
@@ -105,9 +39,19 @@ def cost_analysis_by_cadr(
         ):
 
     data = analyse.cost_analysis_by_cadr(cadr, data)
+    plot_cost_analysis(data, path=path, name=name)
+
+
+def plot_cost_analysis(data, /, path=productsdir, name='default', maxrank=None):
+
+    if maxrank is not None:
+        ranks = analyse.dominance_ranks(
+            data.loc[:, ['upfront', 'running', 'noise']].to_numpy()
+            )
+        data = data.loc[ranks <= maxrank]
     data = data.sort_values('upfront')
     # data = data.loc[data['nunits'] < 6]
-    data = data.drop('Dyson', level='manufacturer')
+    data = analyse.drop_excluded(data)
     data['fullname'] = tuple(map(
         ''.join, zip(
             map(' '.join, data.index),
@@ -163,7 +107,7 @@ def cost_analysis_by_cadr(
         ncol=2,
         )
 
-    noisecmap = load.get_parameters_data().loc['noise cmap', 'value']
+    noisecmap = load.get_parameters().noise_cmap
     noisecolours = tuple(
         map(plt.get_cmap(noisecmap), Normalize(20, 80)(data['noise']))
         )
@@ -188,8 +132,9 @@ def overview(path=productsdir, name='overview'):
     vols, quals = load.get_volume_data(), load.get_quality_data()
     mediumvol = f"{round(vols.loc['medium', 'levels'])} m<sup>3</sup>"
     # goodqual = f"{round(quals.loc['good', 'levels'])} ACH"
-    nomperiod = round(float(load.get_parameters_data().loc['nominal period', 'value']))
-    nompower = float(load.get_parameters_data().loc['nominal power cost', 'value'])
+    params = load.get_parameters()
+    nomperiod = round(params.nominal_period)
+    nompower = params.nominal_power_cost
 
     strn = ''
 
@@ -330,54 +275,156 @@ def old_decision_tool(path=productsdir, name='decision_tool'):
         file.write(strn)
 
 
-def multi_cost_analysis(path=productsdir):
+def multi_cost_grid():
+    vols, quals = load.get_volume_data(), load.get_quality_data()
+    return analyse.cost_grid(None, vols['levels'], quals['levels'])
+
+
+def multi_cost_analysis(path=productsdir, grid=None, charts=None, maxrank=None):
 
+    # 'charts', if given, holds the (volume, quality) levels to redraw.
     vols, quals = load.get_volume_data(), load.get_quality_data()
+    if grid is None:
+        grid = multi_cost_grid()
+    if charts is not None:
+        charts = set(charts)
 
     for voli, vol in enumerate(vols['levels']):
         for quali, qual in enumerate(quals['levels']):
-            cost_analysis(
-                volume=vol, quality=qual,
-                path=path, name=f"{voli}_{quali}",
+            if charts is not None and (vol, qual) not in charts:
+                continue
+            plot_cost_analysis(
+                grid.xs((vol, qual), level=('volume', 'quality')),
+                path=path, name=f"{voli}_{quali}", maxrank=maxrank,
                 )
 
 
-def decision_tool(soft=False):
+WIDTH_RANGE = range(4, 8)
+LENGTH_RANGE = range(4, 8)
+HEIGHT_RANGE = range(2, 5)
+WINDOW_RANGE = range(6)
+DOOR_RANGE = range(3)
+MECH_RANGE = range(2)
+PERSON_RANGE = range(1, 6, 1)
+ACTIVITY_RANGE = range(3)
+ACH_RANGE = range(0, 16)
 
-    width_range = range(4, 8)
-    length_range = range(4, 8)
-    height_range = range(2, 5)
-    window_range = range(6)
-    door_range = range(3)
-    mech_range = range(2)
-    person_range = range(1, 6, 1)
-    activity_range = range(3)
-    allvols = tuple(sorted(set(map(np.product, itertools.product(
-        width_range, length_range, height_range,
+
+def room_volumes():
+    return tuple(sorted(set(map(np.prod, itertools.product(
+        WIDTH_RANGE, LENGTH_RANGE, HEIGHT_RANGE,
         )))))
-    ach_range = range(0, 16)
-    cadrs = tuple(sorted(set(
+
+
+def cost_buckets():
+    return tuple(sorted(set(
         math.ceil(val / 100) * 100
-        for val in map(np.product, tuple(itertools.product(ach_range, allvols)))))
+        for val in map(np.prod, tuple(itertools.product(ACH_RANGE, room_volumes()))))
+        ))
+
+
+def cost_targets(cadrs=None, /):
+    # The CADRs the cost charts for the given buckets are analysed at.
+    if cadrs is None:
+        cadrs = cost_buckets()
+    return sorted(set(max(100, cadr) for cadr in cadrs))
+
+
+ROOMCHUNK = 512
+
+# Tenth-of-a-pixel coordinates are indistinguishable at the rendered size;
+# hidden polygons are culled and each person drawn as a single outline.
+ROOMENCODING = dict(precision=1, paths=True, optimise=True)
+
+
+def room_combos():
+    return itertools.product(
+        WIDTH_RANGE, LENGTH_RANGE, HEIGHT_RANGE,
+        PERSON_RANGE, ACTIVITY_RANGE,
+        WINDOW_RANGE, DOOR_RANGE, MECH_RANGE,
         )
 
-    if not soft:
+
+def _render_rooms(room_combos, outpath, minvol, /):
+    # Module-level so that it can be shipped to worker processes.
+    start = time.perf_counter()
+    for room_combo in room_combos:
+        scale = np.power(1/np.prod(room_combo[:3]), 1/3) / np.power(1/minvol, 1/3)
+        room = svg.draw_scene(*room_combo, size=2, **ROOMENCODING)
+        room.projection.scale(scale)
+        room.save_svg('_'.join(map(str, room_combo)), outpath)
+    return len(room_combos), time.perf_counter() - start
+
+
+def render_rooms(outpath=None, /, jobs=None, chunksize=ROOMCHUNK):
+    if outpath is None:
         outpath = os.path.join(productsdir, 'rooms')
-        room_combos = tuple(itertools.product(
-            width_range, length_range, height_range,
-            person_range, activity_range,
-            window_range, door_range, mech_range,
-            ))
-        for room_combo in room_combos:
-            scale = np.power(1/np.product(room_combo[:3]), 1/3) / np.power(1/np.min(allvols), 1/3)
-            room = svg.draw_scene(*room_combo, size=2)
-            room.projection.scale(scale)
-            room.save_svg('_'.join(map(str, room_combo)), outpath)
+    total = math.prod(map(len, (
+        WIDTH_RANGE, LENGTH_RANGE, HEIGHT_RANGE,
+        PERSON_RANGE, ACTIVITY_RANGE,
+        WINDOW_RANGE, DOOR_RANGE, MECH_RANGE,
+        )))
+    minvol = np.min(room_volumes())
+    # Combos are streamed out in chunks, never materialised all at once.
+    combos = room_combos()
+    chunks = iter(lambda: tuple(itertools.islice(combos, chunksize)), ())
+    start = time.perf_counter()
+    done = 0
+
+    def report(count, elapsed, /):
+        nonlocal done
+        done += count
+        print(
+            f"Rendered rooms {done}/{total}: "
+            f"chunk of {count} in {elapsed:.2f}s, "
+            f"{time.perf_counter() - start:.1f}s total"
+            )
+
+    if jobs is None or jobs < 2:
+        for chunk in chunks:
+            report(*_render_rooms(chunk, outpath, minvol))
+        return
+    with ProcessPoolExecutor(jobs) as executor:
+        # At most two chunks per worker in flight keeps memory bounded.
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_render_rooms, chunk, outpath, minvol))
+            if len(pending) >= 2 * jobs:
+                report(*pending.popleft().result())
+        while pending:
+            report(*pending.popleft().result())
+
+
+def decision_tool(
+        soft=False, rooms=True, costs=None, results=None, jobs=None,
+        maxrank=None,
+        ):
 
-    if not soft:
+    width_range = WIDTH_RANGE
+    length_range = LENGTH_RANGE
+    height_range = HEIGHT_RANGE
+    window_range = WINDOW_RANGE
+    door_range = DOOR_RANGE
+    mech_range = MECH_RANGE
+    person_range = PERSON_RANGE
+    activity_range = ACTIVITY_RANGE
+    cadrs = cost_buckets()
+    if costs is not None:
+        costs = set(costs)
+        cadrs = tuple(cadr for cadr in cadrs if max(100, cadr) in costs)
+
+    if rooms and not soft:
+        render_rooms(jobs=jobs)
+
+    if cadrs and not soft:
         outpath = os.path.join(productsdir, 'costs')
+        if results is None:
+            results = analyse.cost_analysis_by_cadrs(cost_targets(cadrs))
         for cadr in cadrs:
-            cost_analysis_by_cadr(max(100, cadr), path=outpath, name=str(cadr))
+            plot_cost_analysis(
+                results.xs(float(max(100, cadr)), level='cadr'),
+                path=outpath, name=str(cadr), maxrank=maxrank,
+                )
 
     all_style = html.Style(
         # '''.container {''',
@@ -705,7 +752,10 @@ def decision_tool(soft=False):
     page.save_html('decision_tool', productsdir)
 
 
-def synoptic(data=None, /, volume='medium', quality='some', path=productsdir):
+def synoptic(
+        data=None, /, volume='medium', quality='some', path=productsdir,
+        maxrank=None,
+        ):
 
     if isinstance(volume, str):
         volstr = volume
@@ -721,10 +771,14 @@ def synoptic(data=None, /, volume='medium', quality='some', path=productsdir):
     # title = f"Air cleaners on the market:\nefficacy for a {volstr} sized room with {qualstr} air quality."
     title = f"Air cleaning and cost efficiencies for a medium sized room ($78m^3$)"
 
+    if maxrank is not None:
+        ranks = analyse.skyline(data, volume=volume)['rank']
     data = analyse.synoptic_analysis(data, volume=volume)
+    if maxrank is not None:
+        data = data.loc[ranks.index[ranks <= maxrank]]
 
     norm = Normalize(20, 80)
-    noisecmap = load.get_parameters_data().loc['noise cmap', 'value']
+    noisecmap = load.get_parameters().noise_cmap
     cmap = plt.get_cmap(noisecmap)
     noisecolours = tuple(
         map(cmap, norm(data['noise']))
@@ -0,0 +1,219 @@
+###############################################################################
+''''''
+###############################################################################
+
+
+import math
+from collections import namedtuple
+from functools import cache
+
+import numpy as np
+
+from . import load, analyse
+
+
+# Ventilation and fouling model, ported from the decision tool's script.
+
+WIND_SPEED = 3
+WINDOW_AREA = 0.5 * 0.8
+DOOR_AREA = 0.6 * 1.9
+MECH_ACH = 6
+BASELINE_ACH = 3
+MIN_ACH = 4
+MAX_ACH = 15
+ACTIVITY_MULTIPLIERS = (1, 3, 10)
+LITRES_PER_SECOND_PP = 10
+CADR_STEP = 100
+MIN_CADR = 100
+
+
+def _round(val, /):
+    # Javascript's Math.round: halves round up.
+    return math.floor(val + 0.5)
+
+
+def natural_vent_rate(windows, doors, /):
+    window_area = WINDOW_AREA * windows
+    door_area = DOOR_AREA * doors
+    if windows > 0 and doors > 0:
+        coeff, aperture = 0.1, min(window_area, door_area)
+    else:
+        coeff, aperture = 0.01, max(window_area, door_area)
+    return coeff * WIND_SPEED * aperture * 3600
+
+
+def vent_rate(windows, doors, mech, volume, /):
+    natural = natural_vent_rate(windows, doors)
+    mechanical = mech * MECH_ACH * volume
+    baseline = BASELINE_ACH * volume
+    return natural + mechanical + baseline
+
+
+def fouling_rate(persons, activity, volume, /):
+    multiplier = ACTIVITY_MULTIPLIERS[activity]
+    policy_1 = 0.35 * multiplier * volume * persons
+    policy_2 = multiplier * LITRES_PER_SECOND_PP * 3600 / 1000 * persons
+    return max(policy_1, policy_2)
+
+
+def room_demand(length, width, height, persons, activity, windows, doors, mech, /):
+    volume = length * width * height
+    provided = _round(vent_rate(windows, doors, mech, volume) / volume)
+    required = max(MIN_ACH, _round(fouling_rate(persons, activity, volume) / volume))
+    extra = max(0, required - provided)
+    cadr = max(
+        MIN_CADR,
+        math.ceil(min(MAX_ACH, extra) * volume / CADR_STEP) * CADR_STEP,
+        )
+    return volume, provided, required, extra, cadr
+
+
+def room_demands(length, width, height, persons, activity, windows, doors, mech, /):
+    # Array form of room_demand, broadcasting over all arguments.
+    length, width, height, persons, activity, windows, doors, mech = \
+        np.broadcast_arrays(
+            length, width, height, persons, activity, windows, doors, mech,
+            )
+    volume = length * width * height
+    window_area = WINDOW_AREA * windows
+    door_area = DOOR_AREA * doors
+    cross = (windows > 0) & (doors > 0)
+    natural = np.where(cross, 0.1, 0.01) * WIND_SPEED * np.where(
+        cross,
+        np.minimum(window_area, door_area),
+        np.maximum(window_area, door_area),
+        ) * 3600
+    vent = natural + mech * MECH_ACH * volume + BASELINE_ACH * volume
+    multiplier = np.take(ACTIVITY_MULTIPLIERS, activity)
+    fouling = np.maximum(
+        0.35 * multiplier * volume * persons,
+        multiplier * LITRES_PER_SECOND_PP * 3600 / 1000 * persons,
+        )
+    provided = np.floor(vent / volume + 0.5)
+    required = np.maximum(MIN_ACH, np.floor(fouling / volume + 0.5))
+    extra = np.maximum(0, required - provided)
+    cadr = np.maximum(
+        MIN_CADR,
+        np.ceil(np.minimum(MAX_ACH, extra) * volume / CADR_STEP) * CADR_STEP,
+        )
+    return volume, provided, required, extra, cadr
+
+
+Recommendation = namedtuple(
+    'Recommendation',
+    ('volume', 'provided', 'required', 'extra', 'cadr', 'devices'),
+    )
+
+Option = namedtuple(
+    'Option', ('device', 'nunits', 'upfront', 'running', 'noise'),
+    )
+
+
+class Recommender:
+
+    # Cost tables for every CADR bucket are computed up front with the
+    # batched cost kernel and kept sorted by upfront cost, so a query is
+    # a little arithmetic and a row lookup.
+
+    __slots__ = (
+        '_catalogue', '_nomcost', '_devices',
+        'index', 'cadrs', 'order', 'nunits', 'upfront', 'running', 'noise',
+        )
+
+    def __init__(self, data=None, /, maxcadr=3000):
+        if data is None:
+            data = load.get_main_data()
+        # Only devices the decision tool's charts show can be recommended.
+        self._catalogue = analyse.catalogue(analyse.drop_excluded(data))
+        self._nomcost = load.get_parameters().nominal_power_cost
+        self.index = self._catalogue.index
+        self._devices = tuple(self.index)
+        self._tabulate(maxcadr)
+
+    def _tabulate(self, maxcadr, /):
+        cat = self._catalogue
+        self.cadrs = np.arange(MIN_CADR, maxcadr + CADR_STEP, CADR_STEP, dtype=float)
+        metrics = analyse.cost_kernel(
+            cat, cat.cadr / self.cadrs[:, None], self._nomcost,
+            )
+        order = np.argsort(metrics['upfront'], axis=1, kind='stable')
+        self.order = order
+        self.nunits, self.upfront, self.running, self.noise = (
+            np.take_along_axis(metrics[key], order, axis=1)
+            for key in ('nunits', 'upfront', 'running', 'noise')
+            )
+
+    def _bucket(self, cadr, /):
+        rows = np.asarray(cadr).astype(int) // CADR_STEP - MIN_CADR // CADR_STEP
+        if np.any(rows >= len(self.cadrs)):
+            self._tabulate(int(np.max(cadr)))
+        return rows
+
+    def options(self, cadr, /, top=5):
+        row = int(cadr) // CADR_STEP - MIN_CADR // CADR_STEP
+        if row >= len(self.cadrs):
+            self._tabulate(int(cadr))
+        devices = self._devices
+        return tuple(
+            Option(
+                devices[self.order[row, col]],
+                int(self.nunits[row, col]),
+                float(self.upfront[row, col]),
+                float(self.running[row, col]),
+                float(self.noise[row, col]),
+                )
+            for col in range(min(top, self.order.shape[1]))
+            )
+
+    def recommend(
+            self, length, width, height, persons, activity, windows, doors, mech,
+            /, top=5,
+            ):
+        volume, provided, required, extra, cadr = room_demand(
+            length, width, height, persons, activity, windows, doors, mech,
+            )
+        return Recommendation(
+            volume, provided, required, extra, cadr, self.options(cadr, top),
+            )
+
+    def recommend_many(
+            self, length, width, height, persons, activity, windows, doors, mech,
+            /, top=5,
+            ):
+        # Returns the room demands plus (rooms, top) arrays of catalogue
+        # positions (into self.index) and their metrics.
+        volume, provided, required, extra, cadr = room_demands(
+            length, width, height, persons, activity, windows, doors, mech,
+            )
+        rows = self._bucket(cadr)[..., None]
+        cols = np.arange(min(top, self.order.shape[1]))
+        return dict(
+            volume=volume, provided=provided, required=required,
+            extra=extra, cadr=cadr,
+            device=self.order[rows, cols],
+            nunits=self.nunits[rows, cols],
+            upfront=self.upfront[rows, cols],
+            running=self.running[rows, cols],
+            noise=self.noise[rows, cols],
+            )
+
+
+@cache
+def get_recommender():
+    return Recommender()
+
+
+def recommend(length, width, height, persons, activity, windows, doors, mech, /, top=5):
+    return get_recommender().recommend(
+        length, width, height, persons, activity, windows, doors, mech, top=top,
+        )
+
+
+def recommend_many(length, width, height, persons, activity, windows, doors, mech, /, top=5):
+    return get_recommender().recommend_many(
+        length, width, height, persons, activity, windows, doors, mech, top=top,
+        )
+
+
+###############################################################################
+###############################################################################
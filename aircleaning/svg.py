@@ -4,15 +4,36 @@
 
 
 import abc
-from collections import UserList
+from collections import UserList, Counter as _Counter
+from functools import cache as _cache
 import itertools as _itertools
 import os as _os
+import io as _io
+import re as _re
 import colorsys
 
 import numpy as np
-from scipy.spatial.transform import Rotation
 
-from .html import Normal as _Normal, Void as _Void
+try:
+    from matplotlib.colors import CSS4_COLORS as _NAMEDCOLOURS
+except ImportError:
+    _NAMEDCOLOURS = {}
+
+from .html import Normal as _Normal, Void as _Void, write_lines as _write_lines
+from .caching import LRUCache as _LRUCache
+
+
+@_cache
+def rotation_matrix(pan, tilt, /):
+    # Pan about the vertical axis, then tilt about the (fixed) horizontal
+    # axis; shared read-only across every transform with the same angles.
+    pan, tilt = np.radians(-pan), np.radians(-tilt)
+    cosp, sinp, cost, sint = np.cos(pan), np.sin(pan), np.cos(tilt), np.sin(tilt)
+    zrot = np.array(((cosp, -sinp, 0), (sinp, cosp, 0), (0, 0, 1)))
+    xrot = np.array(((1, 0, 0), (0, cost, -sint), (0, sint, cost)))
+    out = xrot @ zrot
+    out.flags.writeable = False
+    return out
 
 
 class Transform:
@@ -66,13 +87,13 @@ class Transform:
         try:
             return self._transform
         except AttributeError:
-            transform = self._transform = Rotation.from_euler(
-                'zx', (-self.panval, -self.tiltval), degrees=True
-                )
+            transform = self._transform = \
+                rotation_matrix(self.panval, self.tiltval)
             return transform
 
     def __call__(self, arr, /):
-        return self.transform.apply(np.array(arr) - self.focus)
+        # Accepts any (..., 3) stack of points in one call.
+        return (np.asarray(arr, dtype=float) - self.focus) @ self.transform.T
 
 
 class Projection:
@@ -110,10 +131,10 @@ class Projection:
         self.scaleval *= val
 
     def __call__(self, arg, /):
-        arr = np.array(arg) * self.scaleval
-        arr[:, 0] += self.width / 2
-        arr[:, 1] = self.height / 2 - arr[:, 1]
-        return arr[:, :-1]
+        arr = np.array(arg, dtype=float) * self.scaleval
+        arr[..., 0] += self.width / 2
+        arr[..., 1] = self.height / 2 - arr[..., 1]
+        return arr[..., :-1]
 
 
 class View:
@@ -131,10 +152,212 @@ class View:
     def transform(self, /):
         return self._transform
 
+    @property
+    def signature(self, /):
+        # Everything that decides where a model point lands on the page.
+        transform, projection = self.transform, self.projection
+        return (
+            tuple(transform.focus.tolist()), transform.panval, transform.tiltval,
+            projection.width, projection.height, projection.scaleval,
+            )
+
     def __call__(self, entity, /):
         return self.projection(self.transform(entity))
 
 
+_HSL = _re.compile(
+    r"hsl\(\s*([-\d.]+)\s*,\s*([\d.]+)%\s*,\s*([\d.]+)%\s*\)"
+    )
+
+
+@_cache
+def _colour_names():
+    out = {}
+    for name, hexval in _NAMEDCOLOURS.items():
+        hexval = hexval.lower()
+        if hexval not in out or len(name) < len(out[hexval]):
+            out[hexval] = name
+    return out
+
+
+@_cache
+def compact_colour(colour, /):
+    # The shortest equivalent of a named, hex or hsl() colour;
+    # anything unrecognised is passed through untouched.
+    colour = str(colour).strip()
+    lowered = colour.lower()
+    if lowered in _NAMEDCOLOURS:
+        hexval = _NAMEDCOLOURS[lowered].lower()
+    elif _re.fullmatch(r"#[0-9a-f]{6}", lowered):
+        hexval = lowered
+    elif _re.fullmatch(r"#[0-9a-f]{3}", lowered):
+        hexval = '#' + ''.join(char*2 for char in lowered[1:])
+    elif (match := _HSL.fullmatch(lowered)):
+        hue, saturation, lightness = map(float, match.groups())
+        rgb = colorsys.hls_to_rgb(hue / 360 % 1, lightness / 100, saturation / 100)
+        hexval = '#' + ''.join(f"{round(val * 255):02x}" for val in rgb)
+    else:
+        return colour
+    candidates = [hexval]
+    if hexval[1::2] == hexval[2::2]:
+        candidates.append('#' + hexval[1::2])
+    if hexval in _colour_names():
+        candidates.append(_colour_names()[hexval])
+    return min(candidates, key=lambda val: (len(val), val))
+
+
+def _number_format(precision, /):
+    # Enough significant figures for the requested decimal places,
+    # with %g dropping any trailing zeros.
+    return f"%.{precision + 7}g"
+
+
+@_cache
+def _points_template(count, precision, /):
+    fmt = _number_format(precision)
+    return ' '.join([f"{fmt},{fmt}"] * count)
+
+
+@_cache
+def _path_template(count, precision, /):
+    fmt = _number_format(precision)
+    return f"M{fmt},{fmt}l" + ' '.join([f"{fmt},{fmt}"] * (count - 1)) + 'z'
+
+
+def _flatten(points, /):
+    # Any sequence of (k, 2) polygons, ragged or not, as one (m, 2) array
+    # along with the vertex count of each polygon.
+    if isinstance(points, np.ndarray):
+        return points.reshape(-1, points.shape[-1]), [points.shape[-2]] * len(points)
+    counts = list(map(len, points))
+    if not counts:
+        return np.empty((0, 2)), counts
+    return np.concatenate(points), counts
+
+
+def _rings(counts, /):
+    # Start of each polygon, and the index of the next vertex round its ring.
+    counts = np.asarray(counts)
+    starts = np.cumsum(counts) - counts
+    following = np.arange(1, counts.sum() + 1)
+    following[starts + counts - 1] = starts
+    return starts, following
+
+
+def signed_areas(arr, counts, /):
+    starts, following = _rings(counts)
+    cross = arr[:, 0] * arr[following, 1] - arr[following, 0] * arr[:, 1]
+    return np.add.reduceat(cross, starts) / 2
+
+
+def format_points(points, precision, /):
+    # Formats n polygons as n 'x,y x,y ...' strings in one pass.
+    arr, counts = _flatten(points)
+    if not counts:
+        return []
+    arr = np.round(arr, precision) + 0.
+    template = '\n'.join([_points_template(count, precision) for count in counts])
+    return (template % tuple(arr.ravel().tolist())).split('\n')
+
+
+def format_path(points, precision, /):
+    # Formats n polygons as n closed path commands with relative
+    # coordinates; every polygon is wound the same way, so that several
+    # can share one path under the default nonzero fill rule.
+    arr, counts = _flatten(points)
+    if not counts:
+        return []
+    arr = np.round(arr, precision) + 0.
+    starts = np.cumsum(counts) - counts
+    flip = signed_areas(arr, counts) < 0
+    if flip.any():
+        ring = np.repeat(np.arange(len(counts)), counts)
+        order = np.arange(len(arr))
+        flipped = flip[ring]
+        order[flipped] = (2 * starts + np.asarray(counts) - 1)[ring[flipped]] - order[flipped]
+        arr = arr[order]
+    # Leading point first, then each step to the next, rounded as written.
+    steps = np.round(arr[1:] - arr[:-1], precision) + 0.
+    leading = np.zeros(len(arr), dtype=bool)
+    leading[starts] = True
+    arr[~leading] = steps[~leading[1:]]
+    template = '\n'.join([_path_template(count, precision) for count in counts])
+    text = template % tuple(arr.ravel().tolist())
+    return text.replace(' -', '-').replace(',-', '-').split('\n')
+
+
+def _union_outline(rects, /):
+    # Outlines of the union of axis-aligned (u0, u1, v0, v1) rectangles,
+    # traced anticlockwise along the boundaries of the covered grid cells;
+    # None where the union has holes or touches itself at a corner.
+    us = sorted(set(val for rect in rects for val in rect[:2]))
+    vs = sorted(set(val for rect in rects for val in rect[2:]))
+    covered = np.zeros((len(us) + 1, len(vs) + 1), dtype=bool)
+    for u0, u1, v0, v1 in rects:
+        covered[us.index(u0)+1:us.index(u1)+1, vs.index(v0)+1:vs.index(v1)+1] = True
+    edges = {}
+    for i, j in zip(*np.nonzero(covered)):
+        for side, start, end in (
+                (covered[i, j-1], (i-1, j-1), (i, j-1)),
+                (covered[i+1, j], (i, j-1), (i, j)),
+                (covered[i, j+1], (i, j), (i-1, j)),
+                (covered[i-1, j], (i-1, j), (i-1, j-1)),
+                ):
+            if side:
+                continue
+            if start in edges:
+                return None
+            edges[start] = end
+    loops = []
+    while edges:
+        start, end = edges.popitem()
+        loop = [start]
+        while end != start:
+            loop.append(end)
+            end = edges.pop(end)
+        # Only the corners, where the direction of travel turns.
+        loop = [
+            here for prev, here, nxt in zip(loop[-1:] + loop[:-1], loop, loop[1:] + loop[:1])
+            if (here[0] - prev[0]) * (nxt[1] - here[1]) != (here[1] - prev[1]) * (nxt[0] - here[0])
+            ]
+        loop = np.array([(us[i], vs[j]) for i, j in loop], dtype=float)
+        if signed_areas(loop, [len(loop)])[0] <= 0:
+            return None
+        loops.append(loop)
+    return loops
+
+
+@_cache
+def _cached_union_outline(rects, /):
+    return _union_outline(rects)
+
+
+def _plane_outlines(orientation, rects, fixed, /):
+    # Model-space outlines of the union of (u0, u1, v0, v1) rectangles
+    # lying in one plane, or None if it cannot be drawn as plain polygons.
+    rects = np.asarray(rects, dtype=float)
+    rects = np.concatenate((
+        rects[:, :2].min(axis=-1, keepdims=True), rects[:, :2].max(axis=-1, keepdims=True),
+        rects[:, 2:].min(axis=-1, keepdims=True), rects[:, 2:].max(axis=-1, keepdims=True),
+        ), axis=-1)
+    # Outlines are cached relative to the rectangles' corner, so that
+    # translated copies (people, say) are traced only once.
+    origin = rects[:, 0].min(), rects[:, 2].min()
+    rel = rects - (origin[0], origin[0], origin[1], origin[1])
+    outlines = _cached_union_outline(tuple(map(tuple, rel.tolist())))
+    if outlines is None:
+        return None
+    ud, vd, fd = Flat._omap[orientation]
+    out = []
+    for outline in outlines:
+        arr = np.empty((len(outline), 3), dtype=float)
+        arr[:, ud] = outline[:, 0] + origin[0]
+        arr[:, vd] = outline[:, 1] + origin[1]
+        arr[:, fd] = fixed
+        out.append(arr)
+    return out
+
+
 class SVG(_Normal):
 
     element_type_name = 'svg'
@@ -147,47 +370,294 @@ class SVG(_Normal):
     def yield_attributes(self, /):
         yield 'xmlns', '''"http://www.w3.org/2000/svg"'''
 
+    def yield_svg_lines(self, /):
+        yield from self.yield_svg_boilerplate()
+        yield from self.yield_lines()
+
+    def write_svg(self, file, /):
+        _write_lines(self.yield_svg_lines(), file, self.STANDARD_INDENT)
+
     def _repr_svg_(self, /):
-        standard = self.standard_indent
-        out = []
-        for indent, text in _itertools.chain(
-                self.yield_svg_boilerplate(),
-                self.yield_lines(),
-                ):
-            out.append(indent*standard)
-            out.append(text)
-            out.append('\n')
-        return ''.join(out)
+        out = _io.StringIO()
+        self.write_svg(out)
+        return out.getvalue()
 
     def save_svg(self, /, name, path='.'):
         with open(_os.path.join(path, name) + '.svg', mode='w') as file:
-            file.write(self._repr_svg_())
+            self.write_svg(file)
+
+
+class Scene:
+
+    # Flats as rows of one structured array: the orientation as an index
+    # into ORIENTATIONS, the extents in the flat's own plane, its fixed
+    # coordinate, and its fill as an index into a shared table of colours.
+    ORIENTATIONS = ('xy', 'xz', 'yz')
+    # Rows standing in for any other graphic, which is kept aside.
+    OTHER = 255
+
+    DTYPE = np.dtype([
+        ('orientation', 'u1'),
+        ('u0', 'f8'), ('u1', 'f8'), ('v0', 'f8'), ('v1', 'f8'),
+        ('fixed', 'f8'),
+        ('fill', 'u4'),
+        ])
+
+    __slots__ = ('_data', '_size', '_fills', '_fillindex', '_others', '_sources')
+
+    def __init__(self, capacity=64):
+        self._data = np.zeros(max(int(capacity), 1), dtype=self.DTYPE)
+        self._size = 0
+        self._fills = []
+        self._fillindex = {}
+        self._others = {}
+        # Graphic objects standing behind rows, kept live by sync().
+        self._sources = {}
+
+    def __len__(self, /):
+        return self._size
+
+    @property
+    def data(self, /):
+        return self._data[:self._size]
+
+    @property
+    def fills(self, /):
+        return tuple(self._fills)
+
+    def fill_index(self, fill, /):
+        fill = str(fill)
+        try:
+            return self._fillindex[fill]
+        except KeyError:
+            index = self._fillindex[fill] = len(self._fills)
+            self._fills.append(fill)
+            return index
+
+    def _reserve(self, count, /):
+        start = self._size
+        stop = start + count
+        if stop > len(self._data):
+            data = np.zeros(max(stop, 2 * len(self._data)), dtype=self.DTYPE)
+            data[:start] = self._data[:start]
+            self._data = data
+        self._size = stop
+        return self._data[start:stop]
+
+    def extend_flats(self, orientation, u0, u1, v0, v1, fixed, /, fill='black'):
+        # Appends a batch of flats at once from one-dimensional columns
+        # or single values; orientation and fill may be either too.
+        if isinstance(orientation, str):
+            codes = self.ORIENTATIONS.index(orientation)
+        else:
+            codes = [self.ORIENTATIONS.index(str(val)) for val in orientation]
+        if isinstance(fill, str):
+            fills = self.fill_index(fill)
+        else:
+            fills = list(map(self.fill_index, fill))
+        columns = (codes, u0, u1, v0, v1, fixed, fills)
+        count = max(
+            (len(col) for col in columns if isinstance(col, (np.ndarray, list, tuple))),
+            default=1,
+            )
+        start = self._size
+        rows = self._reserve(count)
+        try:
+            for name, col in zip(self.DTYPE.names, columns):
+                rows[name] = col
+        except ValueError:
+            self._size = start
+            raise
+        return range(start, self._size)
+
+    def _encode(self, graphic, /):
+        if isinstance(graphic, Flat):
+            return (
+                self.ORIENTATIONS.index(graphic.orientation),
+                graphic.u0, graphic.u1, graphic.v0, graphic.v1, graphic.fixed,
+                self.fill_index(graphic.fill),
+                )
+        return (self.OTHER, 0, 0, 0, 0, 0, self.fill_index(getattr(graphic, 'fill', 'black')))
+
+    def append(self, graphic, /):
+        start = self._size
+        row = self._reserve(1)
+        row[0] = self._encode(graphic)
+        if not isinstance(graphic, Flat):
+            self._others[start] = graphic
+        self._sources[start] = graphic
+        return range(start, self._size)
+
+    def graphic(self, index, /):
+        # The object behind a row; flats added in bulk get one on first
+        # request, which then stands behind the row like an appended one.
+        try:
+            return self._sources[index]
+        except KeyError:
+            pass
+        row = self.data[index]
+        graphic = self._sources[index] = Flat(
+            self.ORIENTATIONS[row['orientation']],
+            row['u0'], row['u1'], row['v0'], row['v1'], row['fixed'],
+            fill=self._fills[row['fill']],
+            )
+        return graphic
+
+    def sync(self, /):
+        # Re-reads every row that has an object behind it, so that changes
+        # made to those objects after they were added show in the output.
+        for index, graphic in self._sources.items():
+            self._data[index] = self._encode(graphic)
+
+    def vertices(self, /):
+        # The corners of every flat as one (n, 4, 3) array, built per
+        # orientation rather than per flat; other graphics' rows are left
+        # unfilled.
+        data = self.data
+        out = np.zeros((len(data), 4, 3), dtype=float)
+        for code, orientation in enumerate(self.ORIENTATIONS):
+            mask = data['orientation'] == code
+            if not mask.any():
+                continue
+            rows = data[mask]
+            ud, vd, fd = Flat._omap[orientation]
+            block = np.empty((len(rows), 4, 3), dtype=float)
+            u0, u1, v0, v1 = rows['u0'], rows['u1'], rows['v0'], rows['v1']
+            block[:, :, ud] = np.stack((u0, u0, u1, u1), axis=-1)
+            block[:, :, vd] = np.stack((v0, v1, v1, v0), axis=-1)
+            block[:, :, fd] = rows['fixed'][:, None]
+            out[mask] = block
+        return out
+
+    def models(self, /):
+        # Model-space vertices of every row, ragged if other graphics are in.
+        out = self.vertices()
+        if not self._others:
+            return out
+        out = list(out)
+        for index, graphic in self._others.items():
+            out[index] = np.asarray(graphic.__array__(), dtype=float)
+        return out
 
 
 class Canvas(SVG):
 
-    __slots__ = ('_graphics', '_view',)
+    # Decimal places to which symbol geometry must agree to be shared.
+    SYMBOLPRECISION = 6
+
+    # Projected area (square pixels) below which a polygon is edge-on,
+    # and slack for a vertex lying on an occluder's boundary.
+    DEGENERATE = 1e-6
+    TOLERANCE = 1e-6
+
+    __slots__ = (
+        '_scene', '_groups', '_fragments', '_graphics', '_view',
+        'symbols', 'precision', 'paths', 'optimise',
+        )
 
-    def __init__(self, view = None, *args, **kwargs):
+    def __init__(
+            self, view = None, *args,
+            symbols=True, precision=None, paths=False, optimise=False,
+            **kwargs,
+            ):
         super().__init__(*args, **kwargs)
         if view is None:
             view = View(Projection(), Transform())
         self._view = view
-        self._graphics = []
+        self._scene = Scene()
+        self._groups = []
+        self._fragments = []
+        self._graphics = None
+        self.symbols = bool(symbols)
+        # Compact encoding: coordinates rounded to 'precision' decimal
+        # places, shortest colours, and optionally relative <path> data
+        # with consecutive same-fill polygons merged.
+        self.precision = None if precision is None else int(precision)
+        self.paths = bool(paths)
+        # Merging coplanar flats and culling hidden polygons before output.
+        self.optimise = bool(optimise)
+
+    @property
+    def scene(self, /):
+        return self._scene
+
+    @property
+    def options(self, /):
+        return (self.symbols, self.precision, self.paths, self.optimise)
 
     @property
     def graphics(self, /):
-        return tuple(self._graphics)
+        # The graphics themselves, as in the scene: changes made to them
+        # show in the output. Any fragments are first drawn into the scene
+        # for good, so that theirs are live too.
+        if self._graphics is None:
+            if self._fragments:
+                self._expand()
+            scene = self._scene
+            self._graphics = tuple(map(scene.graphic, range(len(scene))))
+        return self._graphics
+
+    def _expand(self, /):
+        # Rebuilds the scene with every fragment drawn in where it was
+        # added, carrying over the objects behind the canvas's own rows.
+        scene, groups = Scene(len(self._scene)), []
+        for part in self._parts():
+            if part[0] is None:
+                source, partgroups = self._scene, part[1]
+            else:
+                canvas = self._subcanvas()
+                part[1](canvas, *part[2])
+                source, partgroups = canvas._scene, canvas._groups
+            for start, stop in partgroups:
+                offset = len(scene)
+                for index in range(start, stop):
+                    scene.append(source.graphic(index))
+                groups.append((offset, len(scene)))
+        self._scene, self._groups, self._fragments = scene, groups, []
+
+    def add_fragment(self, name, build, /, *args):
+        # Defers part of the scene to output time: build(canvas, *args)
+        # draws it onto a fresh canvas, and the rendered result is reused
+        # wherever the same builder, arguments, view and encoding recur.
+        # The name prefixes its symbols' ids, so must be unique per canvas.
+        self._fragments.append((len(self._groups), str(name), build, tuple(args)))
+        self._graphics = None
+
+    def _parts(self, /):
+        # The canvas's own groups and its fragments, in the order added.
+        done = 0
+        for position, name, build, args in self._fragments:
+            if position > done:
+                yield None, self._groups[done:position]
+                done = position
+            yield name, build, args
+        if len(self._groups) > done:
+            yield None, self._groups[done:]
 
     def add(self, obj, /, *objs):
+        start = len(self._scene)
         if isinstance(obj, Compound):
-            self._graphics.extend(obj.graphics)
+            for graphic in obj.graphics:
+                self._scene.append(graphic)
         else:
-            self._graphics.append(obj)
+            self._scene.append(obj)
+        self._groups.append((start, len(self._scene)))
+        self._graphics = None
         if objs:
             for obj in objs:
                 self.add(obj)
 
+    def add_flats(self, orientation, u0, u1, v0, v1, fixed, /, fill='black', grouped=False):
+        # Adds a batch of flats straight from columns: together as one
+        # compound if 'grouped', otherwise each as a graphic of its own.
+        rows = self._scene.extend_flats(orientation, u0, u1, v0, v1, fixed, fill=fill)
+        if grouped:
+            self._groups.append((rows.start, rows.stop))
+        else:
+            self._groups.extend((index, index + 1) for index in rows)
+        self._graphics = None
+        return rows
+
     @property
     def view(self, /):
         return self._view
@@ -206,10 +676,248 @@ class Canvas(SVG):
         yield 'height', f'"{self.projection.height}"'
         yield 'style', f'"background-color:white"'
 
+    def project(self, models, /):
+        # Projects every polygon at once, however many vertices each has.
+        if isinstance(models, np.ndarray):
+            return list(self.view(models))
+        if not len(models):
+            return []
+        points = self.view(np.concatenate(models))
+        return np.split(points, np.cumsum(list(map(len, models)))[:-1])
+
+    def _merge(self, fills, models, others, groups, offset=0, /):
+        # Runs of coplanar flats with one fill inside a group are replaced
+        # by the outline of their union, wherever that has no holes.
+        data = self._scene.data[offset:offset+len(fills)]
+        keys = list(zip(data['orientation'].tolist(), data['fixed'].tolist(), data['fill'].tolist()))
+        bounds = np.stack((data['u0'], data['u1'], data['v0'], data['v1']), axis=-1)
+        outfills, outmodels, outothers, outgroups = [], [], [], []
+        for start, stop in groups:
+            begin = len(outmodels)
+            index = start
+            while index < stop:
+                end = index + 1
+                if keys[index][0] != Scene.OTHER:
+                    while end < stop and keys[end] == keys[index]:
+                        end += 1
+                outlines = None
+                if end - index > 1:
+                    outlines = _plane_outlines(
+                        Scene.ORIENTATIONS[keys[index][0]], bounds[index:end], keys[index][1],
+                        )
+                if outlines is None:
+                    outfills.extend(fills[index:end])
+                    outmodels.extend(models[index:end])
+                    outothers.extend(others[index:end])
+                else:
+                    outfills.extend([fills[index]] * len(outlines))
+                    outmodels.extend(outlines)
+                    outothers.extend([None] * len(outlines))
+                index = end
+            outgroups.append((begin, len(outmodels)))
+        return outfills, outmodels, outothers, outgroups
+
+    def _cull(self, fills, points, others, groups, /):
+        # Drops polygons seen edge-on (flats are two-sided, so that is the
+        # only way one can face away) and any lying wholly inside a convex
+        # polygon painted after them.
+        if not points:
+            return fills, points, others, groups
+        arr, counts = _flatten(points)
+        starts, following = _rings(counts)
+        ring = np.repeat(np.arange(len(counts)), counts)
+        areas = signed_areas(arr, counts)
+        keep = np.abs(areas) > self.DEGENERATE
+        sense = np.sign(areas)
+        edges = arr[following] - arr
+        turns = edges[:, 0] * edges[following, 1] - edges[:, 1] * edges[following, 0]
+        convex = np.minimum.reduceat(turns * sense[ring], starts) >= -self.TOLERANCE
+        hidden = np.zeros(len(counts), dtype=bool)
+        occluders = np.nonzero(keep & convex)[0]
+        counts = np.asarray(counts)
+        # Occluders are tested together, batched by their number of sides.
+        for count in np.unique(counts[occluders]):
+            batch = occluders[counts[occluders] == count]
+            corners = starts[batch, None] + np.arange(count)
+            rel = arr[None, None, :, :] - arr[corners][..., None, :]
+            side = (
+                edges[corners][..., 0, None] * rel[..., 1]
+                - edges[corners][..., 1, None] * rel[..., 0]
+                )
+            inside = ((side * sense[batch, None, None]) >= -self.TOLERANCE).all(axis=1)
+            within = np.logical_and.reduceat(inside, starts, axis=-1)
+            # Only what is painted before an occluder can be hidden by it.
+            within &= np.arange(len(counts)) < batch[:, None]
+            hidden |= within.any(axis=0)
+        keep = (keep & ~hidden).tolist()
+        outfills, outpoints, outothers, outgroups = [], [], [], []
+        for start, stop in groups:
+            begin = len(outpoints)
+            for index in range(start, stop):
+                if keep[index]:
+                    outfills.append(fills[index])
+                    outpoints.append(points[index])
+                    outothers.append(others[index])
+            if len(outpoints) > begin:
+                outgroups.append((begin, len(outpoints)))
+        return outfills, outpoints, outothers, outgroups
+
+    def _group_keys(self, fills, points, groups, /):
+        # A group (a compound, or a lone graphic) is keyed by its projected
+        # shape relative to its first vertex, and by its fills unless they
+        # are uniform, in which case the fill can go on the <use> instead.
+        keys = []
+        for start, stop in groups:
+            members = points[start:stop]
+            rel = np.round(np.concatenate(members) - members[0][0], self.SYMBOLPRECISION)
+            groupfills = tuple(fills[start:stop])
+            if len(set(groupfills)) == 1:
+                groupfills = None
+            keys.append((tuple(map(len, members)), (rel + 0.).tobytes(), groupfills))
+        return keys
+
+    def _fill(self, colour, /):
+        return colour if self.precision is None else compact_colour(colour)
+
+    def _coordinate(self, val, /):
+        if self.precision is None:
+            return val
+        return _number_format(self.precision) % (round(val, self.precision) + 0.)
+
+    def _elements(self, fills, points, others, /, fill=True):
+        if self.precision is None:
+            for colour, arr, other in zip(fills, points, others):
+                if other is None:
+                    typ, dct = _render_polygon(colour, arr)
+                else:
+                    typ, dct = other.render(arr)
+                if not fill:
+                    dct.pop('fill', None)
+                yield f"<{typ} {' '.join(map('='.join, dct.items()))} />"
+            return
+        if fill:
+            attrs = [f' fill="{compact_colour(colour)}"' for colour in fills]
+        else:
+            attrs = [''] * len(fills)
+        if not self.paths:
+            for attr, pointstr in zip(attrs, format_points(points, self.precision)):
+                yield f'<polygon{attr} points="{pointstr}" />'
+            return
+        commands = format_path(points, self.precision)
+        for attr, run in _itertools.groupby(zip(attrs, commands), key=lambda x: x[0]):
+            yield f'<path{attr} d="{"".join(command for _, command in run)}" />'
+
+    def _render(self, groups, /, prefix='s'):
+        # Symbol definitions and body lines for a run of the scene's groups.
+        if not groups:
+            return [], []
+        scene = self._scene
+        lo, hi = groups[0][0], groups[-1][1]
+        groups = [(start - lo, stop - lo) for start, stop in groups]
+        fills = np.array(scene.fills + ('',), dtype=object)[scene.data['fill'][lo:hi]].tolist()
+        others = list(map(scene._others.get, range(lo, hi)))
+        models = scene.models()[lo:hi]
+        if self.optimise:
+            fills, models, others, groups = self._merge(fills, models, others, groups, lo)
+        # Projecting the whole scene at once rather than per graphic.
+        points = self.project(models)
+        if self.optimise:
+            fills, points, others, groups = self._cull(fills, points, others, groups)
+        if not self.symbols:
+            return [], [(0, line) for line in self._elements(fills, points, others)]
+        # Geometry repeated at different offsets (people, windows, doors)
+        # is defined once as a symbol and placed with <use>.
+        keys = self._group_keys(fills, points, groups)
+        counts = _Counter(keys)
+        symbols = {}
+        for (start, stop), key in zip(groups, keys):
+            if counts[key] > 1 and key not in symbols:
+                symbols[key] = (f"{prefix}{len(symbols)}", start, stop)
+        defs, body = [], []
+        for key, (name, start, stop) in symbols.items():
+            defs.append((1, f'<symbol id="{name}" overflow="visible">'))
+            origin = points[start][0]
+            for line in self._elements(
+                    fills[start:stop],
+                    [arr - origin for arr in points[start:stop]],
+                    others[start:stop],
+                    fill=key[-1] is not None,
+                    ):
+                defs.append((2, line))
+            defs.append((1, "</symbol>"))
+        # Runs of graphics between <use>s are drawn together.
+        run = None
+        for (start, stop), key in zip(groups, keys):
+            if key not in symbols:
+                run = slice(start if run is None else run.start, stop)
+                continue
+            if run is not None:
+                for line in self._elements(fills[run], points[run], others[run]):
+                    body.append((0, line))
+                run = None
+            x, y = map(self._coordinate, points[start][0])
+            attrs = f'href="#{symbols[key][0]}" x="{x}" y="{y}"'
+            if key[-1] is None:
+                attrs += f' fill="{self._fill(fills[start])}"'
+            body.append((0, f"<use {attrs} />"))
+        if run is not None:
+            for line in self._elements(fills[run], points[run], others[run]):
+                body.append((0, line))
+        return defs, body
+
+    def _fragment(self, name, build, args, /):
+        # Builds and renders a fragment on a canvas of its own sharing this
+        # view and encoding, or recalls it if an identical one has been.
+        key = (name, build, args, self.view.signature, self.options)
+        try:
+            return _fragments.get(key)
+        except KeyError:
+            pass
+        canvas = self._subcanvas()
+        build(canvas, *args)
+        out = canvas._render(canvas._groups, prefix=name)
+        _fragments.put(key, out)
+        return out
+
+    def _subcanvas(self, /):
+        return Canvas(self.view, **dict(zip(
+            ('symbols', 'precision', 'paths', 'optimise'), self.options
+            )))
+
     def _yield_lines_(self, /):
-        for graphic in self.graphics:
-            typ, dct = graphic.draw(self.view)
-            yield 0, f"<{typ} {' '.join(map('='.join, dct.items()))} />"
+        self._scene.sync()
+        defs, body = [], []
+        own = 0
+        for part in self._parts():
+            if part[0] is None:
+                partdefs, partbody = self._render(part[1], prefix=f"s{own}_" if own else 's')
+                own += 1
+            else:
+                partdefs, partbody = self._fragment(*part)
+            defs.extend(partdefs)
+            body.extend(partbody)
+        if defs:
+            yield 0, "<defs>"
+            yield from defs
+            yield 0, "</defs>"
+        yield from body
+
+
+FRAGMENTCACHESIZE = 1024
+
+_fragments = _LRUCache(FRAGMENTCACHESIZE)
+
+
+def clear_fragment_cache():
+    _fragments.clear()
+
+
+def _render_polygon(fill, points, /):
+    pointstr = ' '.join(f"{x},{y}" for x, y in points)
+    return (
+        'polygon',
+        dict(fill=f'"{fill}"', points=f'"{pointstr}"'),
+        )
 
 
 class Graphic:
@@ -221,9 +929,12 @@ class Graphic:
         raise NotImplementedError        
 
     @abc.abstractmethod
-    def draw(self, view, /):
+    def render(self, points, /):
         raise NotImplementedError
 
+    def draw(self, view, /):
+        return self.render(view(self))
+
 
 class Flat(Graphic):
 
@@ -361,13 +1072,50 @@ class Flat(Graphic):
         out[:, fd] = self.fixed
         return out
 
-    def draw(self, view, /):
-        arr = view(self)
-        pointstr = ' '.join(f"{x},{y}" for x, y in arr)
-        return (
-            'polygon',
-            dict(fill=f'"{self.fill}"', points=f'"{pointstr}"'),
+    def render(self, points, /):
+        return _render_polygon(self.fill, points)
+
+
+class Polygon(Graphic):
+
+    element_type_name = 'polygon'
+
+    __slots__ = ('_vertices', '_fill')
+
+    def __init__(self, vertices, fill='black'):
+        vertices = np.array(vertices, dtype=float)
+        if vertices.ndim != 2 or vertices.shape[1] != 3:
+            raise ValueError(vertices.shape)
+        self._vertices = vertices
+        self.fill = fill
+
+    @classmethod
+    def union(cls, flats, /):
+        # The outlines of coplanar, same-fill flats merged together,
+        # or None if their union cannot be drawn as plain polygons.
+        first = flats[0]
+        outlines = _plane_outlines(
+            first.orientation,
+            [(flat.u0, flat.u1, flat.v0, flat.v1) for flat in flats],
+            first.fixed,
             )
+        if outlines is None:
+            return None
+        return tuple(cls(outline, first.fill) for outline in outlines)
+
+    @property
+    def fill(self, /):
+        return self._fill
+
+    @fill.setter
+    def fill(self, val, /):
+        self._fill = str(val)
+
+    def __array__(self, /):
+        return self._vertices.copy()
+
+    def render(self, points, /):
+        return _render_polygon(self.fill, points)
 
 
 class Compound:
@@ -574,67 +1322,47 @@ class Person(Compound):
     _NECK_LENGTH = 0.1
     _NECK_WIDTH = 0.6
 
-    def __init__(self, x, y, width=0.3, height=1.7, fill='LightGreen'):
+    @classmethod
+    def columns(cls, x, y, width=0.3, height=1.7):
+        # u0, u1, v0, v1 of the figure's flats (legs, arms, shoulders,
+        # torso, head and neck, in drawing order) and their fixed y.
         hwidth = width / 2
         lside = x-hwidth
         rside = x+hwidth
-        arm_thickness = hwidth*self._ARM_WIDTH
-        lshoulder = lside - hwidth * self._SHOULDER_WIDTH
-        rshoulder = rside + hwidth * self._SHOULDER_WIDTH
-        crotch_height = height * self._CROTCH_HEIGHT
-        head_height = height * (1 - self._HEAD_HEIGHT)
-        head_width = hwidth * self._HEAD_WIDTH
-        neck_width = head_width * self._NECK_WIDTH
-        lleg = Flat(
-            'xz',
-            x-hwidth, x-hwidth*(1-self._LEG_WIDTH),
-            0, crotch_height*1.01,
-            y, fill,
-            )
-        rleg = Flat(
-            'xz',
-            x+hwidth, x+hwidth*(1-self._LEG_WIDTH),
-            0, crotch_height*1.01,
-            y, fill,
-            )
-        larm = Flat(
-            'xz',
-            lshoulder-arm_thickness, lshoulder,
-            crotch_height, head_height,
-            y, fill,
-            )
-        rarm = Flat(
-            'xz',
-            rshoulder, rshoulder+arm_thickness,
-            crotch_height, head_height,
-            y, fill,
-            )
-        shoulders = Flat(
-            'xz',
-            lshoulder, rshoulder,
-            head_height - arm_thickness, head_height,
-            y, fill,
-            )
-        torso = Flat(
-            'xz',
-            x-hwidth, x+hwidth,
-            crotch_height, head_height,
-            y, fill,
-            )
-        head = Flat(
-            'xz',
-            x-head_width, x+head_width,
-            head_height+(height-head_height)*self._NECK_LENGTH, height,
-            y, fill,
-            )
-        neck = Flat(
-            'xz',
-            x-neck_width, x+neck_width,
-            head_height, height,
-            y, fill,
+        arm_thickness = hwidth*cls._ARM_WIDTH
+        lshoulder = lside - hwidth * cls._SHOULDER_WIDTH
+        rshoulder = rside + hwidth * cls._SHOULDER_WIDTH
+        crotch_height = height * cls._CROTCH_HEIGHT
+        head_height = height * (1 - cls._HEAD_HEIGHT)
+        head_width = hwidth * cls._HEAD_WIDTH
+        neck_width = head_width * cls._NECK_WIDTH
+        return (
+            np.array((
+                x-hwidth, x+hwidth, lshoulder-arm_thickness, rshoulder,
+                lshoulder, x-hwidth, x-head_width, x-neck_width,
+                )),
+            np.array((
+                x-hwidth*(1-cls._LEG_WIDTH), x+hwidth*(1-cls._LEG_WIDTH),
+                lshoulder, rshoulder+arm_thickness,
+                rshoulder, x+hwidth, x+head_width, x+neck_width,
+                )),
+            np.array((
+                0, 0, crotch_height, crotch_height,
+                head_height - arm_thickness, crotch_height,
+                head_height+(height-head_height)*cls._NECK_LENGTH, head_height,
+                )),
+            np.array((
+                crotch_height*1.01, crotch_height*1.01, head_height, head_height,
+                head_height, head_height, height, height,
+                )),
+            y,
             )
-        self._graphics = (
-            lleg, rleg, larm, rarm, shoulders, torso, head, neck
+
+    def __init__(self, x, y, width=0.3, height=1.7, fill='LightGreen'):
+        u0s, u1s, v0s, v1s, y = self.columns(x, y, width, height)
+        self._graphics = tuple(
+            Flat('xz', u0, u1, v0, v1, y, fill)
+            for u0, u1, v0, v1 in zip(u0s, u1s, v0s, v1s)
             )
         # super().__init__(x-hwidth, x+hwidth, y-hwidth, y+hwidth, 0, height)
         super().__init__()
@@ -664,56 +1392,59 @@ def html_hsl(hue, saturation, lightness, /):
     return f"hsl({hue*360},{saturation*100}%,{lightness*100}%)"
 
 
-def draw_scene(
-        length=6, width=4, height=2.7, persons=1, activity=0, windows=2, doors=1, mech=True,
-        size=1, scale=1, seed=0,
-        **kwargs,
-        ):
-    canvas = Canvas(**kwargs)
-    canvas.projection.width *= size
-    canvas.projection.height *= size
-    canvas.projection.scale(size)
-    room = Room(length, width, height)
-    canvas.add(room)
-    floor, wall0, wall1 = room.bottom, room.far, room.right
+# Builders for the parts of a room scene, each drawing onto a canvas from
+# only the parameters its geometry depends on, so that draw_scene can
+# cache them as fragments. The room spans the origin to (length, width, height).
+
+def _draw_shell(canvas, length, width, height, /):
+    canvas.add(Room(length, width, height))
+
+
+def _draw_doors(canvas, length, width, doors, /):
     door_spacing = width / (doors + 1)
-    for i in range(1, doors + 1):
-        window = Flat(
-            'yz',
-            room.fv-i*door_spacing-0.3, room.fv-i*door_spacing+0.3,
-            room.bv, room.bv+1.9, room.rv, fill='white',
-            )
-        canvas.add(window)
+    i = np.arange(1, doors + 1)
+    canvas.add_flats(
+        'yz',
+        width-i*door_spacing-0.3, width-i*door_spacing+0.3,
+        0., 1.9, float(length), fill='white',
+        )
     # door = Flat('yz', wall1.uc-0.3, wall1.uc+0.3, 0, 2, room.rv, fill='white')
     # canvas.add(door)
+
+
+def _draw_windows(canvas, length, width, windows, /):
     window_spacing = length / (windows + 1)
-    for i in range(1, windows + 1):
-        window = Flat(
-            'xz',
-            room.lv+i*window_spacing-0.25, room.lv+i*window_spacing+0.25,
-            room.bv+0.8, room.bv+1.6, room.fv, fill='white',
-            )
-        canvas.add(window)
-    if mech:
-        mechbox = Solid(wall0.u1-0.5, wall0.u1, wall1.u1-0.5, wall1.u1, wall0.v1-0.7, wall0.v1-0.2)
-        mechbox.front.fill = 'grey'
-        mechbox.side.fill = 'lightgrey'
-        mechbox.roof.fill = 'darkgrey'
-        canvas.add(mechbox)
+    i = np.arange(1, windows + 1)
+    canvas.add_flats(
+        'xz',
+        i*window_spacing-0.25, i*window_spacing+0.25,
+        0.8, 1.6, float(width), fill='white',
+        )
+
+
+def _draw_mech(canvas, length, width, height, /):
+    mechbox = Solid(length-0.5, length, width-0.5, width, height-0.7, height-0.2)
+    mechbox.front.fill = 'grey'
+    mechbox.side.fill = 'lightgrey'
+    mechbox.roof.fill = 'darkgrey'
+    canvas.add(mechbox)
+
+
+def _draw_persons(canvas, length, width, height, persons, activity, seed, /):
     rng = np.random.default_rng(seed)
     coords = []
     figures = []
     for _ in range(persons):
         for __ in range(100):
-            ucoord = floor.u0 + 1 + rng.random() * (floor.ul - 2)
-            vcoord = floor.v0 + 1 + rng.random() * (floor.vl - 2)
+            ucoord = 1 + rng.random() * (length - 2)
+            vcoord = 1 + rng.random() * (width - 2)
             if not any(
                     abs(ucoord-uval)<1 and abs(vcoord-vval)<1
                     for (uval, vval) in coords
                     ):
                 break
         coords.append((ucoord, vcoord))
-        depth = (vcoord - floor.v0) / floor.vl
+        depth = vcoord / width
         fill = html_hsl(
             (0.8, 0.9, 1.0)[activity],
             0.5,
@@ -721,11 +1452,37 @@ def draw_scene(
             )
         # rgb = {0: (0), 1: (), 2: ()}
         # fill = f"rgb({','.join(map(str, rgb))})"
-        person = Person(ucoord, vcoord, fill=fill)
-        figures.append((depth, person))
+        figures.append((depth, Person.columns(ucoord, vcoord), fill))
     figures.sort(key=lambda x: -x[0])
-    for _, figure in figures:
-        canvas.add(figure)
+    for _, columns, fill in figures:
+        canvas.add_flats('xz', *columns, fill=fill, grouped=True)
+
+
+def draw_scene(
+        length=6, width=4, height=2.7, persons=1, activity=0, windows=2, doors=1, mech=True,
+        size=1, scale=1, seed=0, fragments=True,
+        **kwargs,
+        ):
+    canvas = Canvas(**kwargs)
+    canvas.projection.width *= size
+    canvas.projection.height *= size
+    canvas.projection.scale(size)
+    room = Room(length, width, height)
+    parts = [
+        ('shell', _draw_shell, (length, width, height)),
+        ('door', _draw_doors, (length, width, doors)),
+        ('window', _draw_windows, (length, width, windows)),
+        ]
+    if mech:
+        parts.append(('mech', _draw_mech, (length, width, height)))
+    parts.append(
+        ('person', _draw_persons, (length, width, height, persons, activity, seed))
+        )
+    for name, build, args in parts:
+        if fragments:
+            canvas.add_fragment(name, build, *args)
+        else:
+            build(canvas, *args)
     canvas.transform.focus = room.centre
     canvas.transform.pan(-30)
     canvas.transform.tilt(60)
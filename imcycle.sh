@@ -18,7 +18,7 @@ abort()
 trap 'abort' 0
 set -e
 # sudo bash everestupdate.sh
-python3 -m aircleaning
+python3 -m aircleaning --jobs "$(nproc)"
 trap : 0
 
 echo >&2 '
@@ -0,0 +1,82 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aircleaning import analyse, load
+
+
+@pytest.fixture
+def parameters(monkeypatch):
+    params = load.Parameters({'nominal period': 5, 'nominal power cost': 0.3})
+    monkeypatch.setattr(load, 'get_parameters', lambda: params)
+    return params
+
+
+def _catalogue(nmodels, seed, /):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        dict(
+            cadr=rng.integers(20, 400, nmodels).astype(float),
+            cost=rng.uniform(50, 900, nmodels).round(2),
+            power=rng.uniform(5, 80, nmodels).round(1),
+            filterchanges=rng.integers(1, 4, nmodels).astype(float),
+            filtercost=rng.uniform(10, 120, nmodels).round(2),
+            noise=rng.uniform(25, 60, nmodels).round(1),
+            ionising=False,
+            uv=False,
+            ),
+        index=pd.Index([f"model{i}" for i in range(nmodels)], name='name'),
+        )
+
+
+def _brute_force(opt, target, /):
+    best = np.inf
+    for nunits in range(1, opt.maxunits + 1):
+        for combo in itertools.combinations_with_replacement(range(len(opt.cadr)), nunits):
+            combo = list(combo)
+            if opt.cadr[combo].sum() >= target:
+                best = min(best, opt.cost[combo].sum())
+    return best
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_fleet_optimiser_off_step_targets(parameters, seed):
+    opt = analyse.FleetOptimiser(_catalogue(12, seed), maxunits=3)
+    targets = [95, 101, 233, 347, 509, 761, 999]
+    for target, fleet in opt.sweep(targets).items():
+        assert fleet.cadr >= target
+        assert fleet.cost == pytest.approx(_brute_force(opt, target))
+
+
+def test_fleet_optimiser_counts_exact_cadr(parameters):
+    data = _catalogue(2, 0)
+    data['cadr'] = [98., 200.]
+    data['cost'] = [100., 1000.]
+    fleet = analyse.optimise_fleet(95, data, maxunits=1)
+    assert fleet.devices == ('model0',)
+
+
+def _brute_ranks(values, /):
+    dominated = (
+        (values[:, None] <= values[None]).all(-1)
+        & (values[:, None] < values[None]).any(-1)
+        )
+    ranks = np.zeros(len(values), dtype=int)
+    while True:
+        lifted = np.where(dominated, ranks[:, None] + 1, 0).max(0)
+        if (lifted <= ranks).all():
+            return ranks
+        ranks = np.maximum(ranks, lifted)
+
+
+@pytest.mark.parametrize('ndims', range(1, 5))
+@pytest.mark.parametrize('seed', range(3))
+def test_dominance_ranks_match_brute_force(ndims, seed):
+    rng = np.random.default_rng(seed)
+    # Coarse values force ties and duplicate points into the mix.
+    values = rng.integers(0, 12, (600, ndims)).astype(float)
+    got = analyse.dominance_ranks(values, maximise=(0,))
+    values[:, 0] *= -1
+    assert (got == _brute_ranks(values)).all()
@@ -0,0 +1,28 @@
+import io
+
+import pytest
+
+from aircleaning import svg
+
+
+def _render(canvas, /):
+    buffer = io.StringIO()
+    canvas.write_svg(buffer)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('fragments', (True, False))
+def test_draw_scene_graphics_are_live(fragments):
+    canvas = svg.draw_scene(fragments=fragments)
+    before = _render(canvas)
+    assert 'fill="red"' not in before
+    # The shell's floor, which no other graphic shares geometry with.
+    canvas.graphics[0].fill = 'red'
+    assert _render(canvas).count('fill="red"') == 1
+
+
+def test_draw_scene_graphics_expand_fragments():
+    # Once drawn into the scene, fragments render as if never deferred.
+    canvas = svg.draw_scene()
+    canvas.graphics
+    assert _render(canvas) == _render(svg.draw_scene(fragments=False))